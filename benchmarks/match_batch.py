@@ -0,0 +1,89 @@
+'''Compare QuickUMLS.match called in a loop against QuickUMLS.match_batch.
+
+Usage:
+    python benchmarks/match_batch.py /path/to/quickumls/files texts.txt
+
+where texts.txt contains one document per line.
+'''
+from __future__ import unicode_literals, division, print_function
+
+import io
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+# benchmark the QuickUMLS of this repository, even if it isn't installed
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+from quickumls import QuickUMLS
+
+
+def read_texts(path, limit=None):
+    with io.open(path, encoding='utf-8') as f:
+        texts = [ln.strip() for ln in f if ln.strip()]
+    return texts[:limit] if limit else texts
+
+
+def time_loop(matcher, texts):
+    start = time.time()
+    cnt = sum(len(matcher.match(text)) for text in texts)
+    return time.time() - start, cnt
+
+
+def time_batch(matcher, texts, batch_size, n_process):
+    start = time.time()
+    cnt = sum(
+        len(matches) for matches in matcher.match_batch(
+            texts, batch_size=batch_size, n_process=n_process
+        )
+    )
+    return time.time() - start, cnt
+
+
+def parse_args():
+    ap = ArgumentParser(
+        description='Benchmark per-document matching against match_batch'
+    )
+    ap.add_argument(
+        'quickumls_fp',
+        help='directory where the QuickUMLS data files are installed.'
+    )
+    ap.add_argument('texts_fp', help='file with one document per line')
+    ap.add_argument(
+        '-n', '--limit', default=None, type=int,
+        help='only use the first LIMIT documents'
+    )
+    ap.add_argument('-b', '--batch-size', default=1000, type=int)
+    ap.add_argument('-p', '--n-process', default=1, type=int)
+    return ap.parse_args()
+
+
+def main():
+    opts = parse_args()
+    texts = read_texts(opts.texts_fp, opts.limit)
+    matcher = QuickUMLS(opts.quickumls_fp)
+
+    # warm up the spaCy pipeline and the databases
+    matcher.match(texts[0])
+
+    loop_time, loop_cnt = time_loop(matcher, texts)
+    batch_time, batch_cnt = time_batch(
+        matcher, texts, opts.batch_size, opts.n_process
+    )
+
+    if loop_cnt != batch_cnt:
+        print('[WARNING] loop and batch returned a different number of '
+              'matches ({:,} vs {:,})'.format(loop_cnt, batch_cnt))
+
+    for name, delta in (('match', loop_time), ('match_batch', batch_time)):
+        print('{:<12} {:>8.2f} s  {:>10,.1f} docs/s'.format(
+            name, delta, len(texts) / delta
+        ))
+    print('speedup: {:.2f}x'.format(loop_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
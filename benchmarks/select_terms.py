@@ -0,0 +1,122 @@
+'''Time overlap resolution (QuickUMLS._select_terms) on synthetic documents.
+
+Usage:
+    python benchmarks/select_terms.py -t 20000 -m 5
+
+Candidate matches are generated at random positions of a long document;
+they are selected with toolbox.Intervals and with a linear scan over the
+accepted intervals (the implementation Intervals used to have), and the
+two selections are checked to be identical.
+'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import sys
+import time
+import random
+from argparse import ArgumentParser
+
+# benchmark the QuickUMLS of this repository, even if it isn't installed
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+from quickumls import toolbox
+from quickumls.core import QuickUMLS
+
+
+class LinearIntervals(object):
+    def __init__(self):
+        self.intervals = []
+
+    def __contains__(self, interval):
+        return any(
+            other[0] < interval[1] and other[1] > interval[0]
+            for other in self.intervals
+        )
+
+    def append(self, interval):
+        self.intervals.append(interval)
+
+
+def make_matches(n_tokens, matches_per_token, window, seed):
+    rnd = random.Random(seed)
+    matches = []
+    for _ in range(n_tokens * matches_per_token):
+        start = rnd.randrange(n_tokens) * 6
+        end = start + rnd.randint(1, window) * 6 - 1
+        matches.append([{
+            'start': start,
+            'end': end,
+            'similarity': round(rnd.uniform(0.7, 1.0), 2)
+        }])
+    return matches
+
+
+def select_terms(matches, sort_func, intervals_cls):
+    intervals = intervals_cls()
+    selected = []
+    for match in sorted(matches, key=sort_func, reverse=True):
+        match_interval = (match[0]['start'], match[0]['end'])
+        if match_interval not in intervals:
+            selected.append(match)
+            intervals.append(match_interval)
+    return selected
+
+
+def parse_args():
+    ap = ArgumentParser(
+        description='Benchmark overlap resolution on synthetic documents'
+    )
+    ap.add_argument(
+        '-t', '--n-tokens', default=20000, type=int,
+        help='number of tokens in each synthetic document'
+    )
+    ap.add_argument(
+        '-m', '--matches-per-token', default=5, type=int,
+        help='average number of candidate matches per token'
+    )
+    ap.add_argument(
+        '-w', '--window', default=5, type=int,
+        help='maximum length of a match, in tokens'
+    )
+    ap.add_argument('-s', '--seed', default=0, type=int)
+    return ap.parse_args()
+
+
+def main():
+    opts = parse_args()
+    matches = make_matches(
+        opts.n_tokens, opts.matches_per_token, opts.window, opts.seed
+    )
+    print('{:,} candidate matches over {:,} tokens'.format(
+        len(matches), opts.n_tokens
+    ))
+
+    criteria = (
+        ('score', QuickUMLS._select_score),
+        ('length', QuickUMLS._select_longest)
+    )
+    for name, sort_func in criteria:
+        timings = {}
+        selections = {}
+        for intervals_cls in (LinearIntervals, toolbox.Intervals):
+            start = time.time()
+            selections[intervals_cls] = select_terms(
+                matches, sort_func, intervals_cls
+            )
+            timings[intervals_cls] = time.time() - start
+
+        if selections[LinearIntervals] != selections[toolbox.Intervals]:
+            print('[WARNING] selections differ for criteria "{}"'.format(name))
+
+        print('{:<7} linear {:>8.3f} s  intervals {:>8.3f} s  '
+              'speedup {:>7.1f}x  ({:,} selected)'.format(
+                  name, timings[LinearIntervals], timings[toolbox.Intervals],
+                  timings[LinearIntervals] / timings[toolbox.Intervals],
+                  len(selections[toolbox.Intervals])
+              ))
+
+
+if __name__ == '__main__':
+    main()
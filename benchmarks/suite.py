@@ -0,0 +1,375 @@
+'''Benchmark suite for the QuickUMLS matching hot path.
+
+Usage:
+    python benchmarks/suite.py -o results.json
+    python benchmarks/suite.py --compare before.json after.json
+
+A synthetic UMLS release (MRCONSO.RRF and MRSTY.RRF) is generated and
+installed with quickumls.install for each database backend; synthetic
+documents are then matched with every combination of window, threshold and
+similarity measure. Stages are timed by QuickUMLS.match itself, through
+toolbox.MatchStats (the ngram cache is disabled):
+
+    tokenization  spaCy tokenization
+    ngrams        extraction of the ngrams to look up
+    simstring     retrieval of candidate terms from simstring
+    scoring       similarity of the retrieved candidates with each ngram
+    cui_lookup    lookup of the CUIs and semantic types of the candidates
+    selection     selection of the best, non-overlapping matches
+    match         QuickUMLS.match, end to end, without collecting
+                  statistics (latency percentiles are computed on this
+                  stage)
+
+Documents are tokenized with a blank spaCy pipeline, so no spaCy model is
+needed and the suite runs offline (the NLTK stopwords corpus must be
+available). Results are written as JSON, so that runs on different
+commits can be compared with --compare.
+'''
+from __future__ import unicode_literals, division, print_function
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import datetime
+import tempfile
+import itertools
+import subprocess
+from argparse import ArgumentParser
+
+import spacy
+
+# benchmark the QuickUMLS of this repository, even if it isn't installed
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+from quickumls import QuickUMLS, toolbox
+from quickumls.about import __version__
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+STAGES = toolbox.MatchStats.STAGES + ('match', )
+
+
+def prepare_data(opts):
+    """Generate and install the synthetic UMLS, unless the same data is
+    already in the work directory; returns the documents and the time
+    each backend took to install."""
+    params = {
+        'n_concepts': opts.n_concepts, 'n_docs': opts.n_docs,
+        'doc_length': opts.doc_length, 'seed': opts.seed,
+        'backends': sorted(opts.backends),
+        'version': __version__
+    }
+    params_fp = os.path.join(opts.workdir, 'params.json')
+    docs_fp = os.path.join(opts.workdir, 'docs.json')
+
+    if not opts.rebuild and os.path.exists(params_fp):
+        with io.open(params_fp, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved['params'] == params:
+            with io.open(docs_fp, encoding='utf-8') as f:
+                return json.load(f), saved['install_seconds']
+
+    umls_dir = os.path.join(opts.workdir, 'umls')
+    if os.path.exists(umls_dir):
+        shutil.rmtree(umls_dir)
+    os.makedirs(umls_dir)
+
+    print('generating synthetic UMLS...', file=sys.stderr)
+    vocab, terms = make_umls(umls_dir, opts.n_concepts, opts.seed)
+    docs = make_documents(
+        vocab, terms, opts.n_docs, opts.doc_length, opts.seed
+    )
+
+    install_seconds = {}
+    for backend in opts.backends:
+        print('installing ({})...'.format(backend), file=sys.stderr)
+        install_seconds[backend] = install(
+            umls_dir, os.path.join(opts.workdir, backend), backend
+        )
+
+    with io.open(docs_fp, 'w', encoding='utf-8') as f:
+        json.dump(docs, f)
+    with io.open(params_fp, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'install_seconds': install_seconds}, f)
+
+    return docs, install_seconds
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def time_stages(matcher, texts):
+    """Time each stage on all texts; returns the seconds spent in each
+    stage, the number of items processed, and per-document latencies."""
+    stats = toolbox.MatchStats()
+    for text in texts:
+        matcher.match(text, stats=stats)
+
+    seconds = dict(stats.timings)
+    counters = stats.counters
+    items = {
+        'tokenization': counters['tokens'],
+        'ngrams': counters['ngrams'],
+        'simstring': (
+            counters['ngrams'] - counters['ngram_cache_hits'] -
+            counters['queries_skipped']
+        ),
+        'scoring': counters['candidates_retrieved'],
+        'cui_lookup': (
+            counters['candidates_retrieved'] -
+            counters['candidates_capped'] -
+            counters['rejected_by_similarity']
+        ),
+        'selection': counters['concepts']
+    }
+
+    # collecting statistics has some overhead, so latencies are
+    # measured separately
+    latencies = []
+    for text in texts:
+        start = time.time()
+        matcher.match(text)
+        latencies.append(time.time() - start)
+    seconds['match'] = sum(latencies)
+    items['match'] = len(texts)
+
+    return seconds, items, latencies
+
+
+def run_config(quickumls_fp, nlp, texts, backend, window, threshold,
+               similarity, repeat):
+    # the matcher is created without its own spaCy pipeline, so that no
+    # model needs to be installed; the blank pipeline is used instead
+    matcher = QuickUMLS(
+        quickumls_fp, window=window, threshold=threshold,
+        similarity_name=similarity, ngram_cache_size=0,
+        spacy_component=True
+    )
+    matcher.nlp = nlp
+
+    try:
+        # warm up the databases and the OS page cache
+        for text in texts[:10]:
+            matcher.match(text)
+
+        # the fastest of all repetitions is kept for every stage
+        best_seconds = best_latencies = items = None
+        for _ in range(repeat):
+            seconds, items, latencies = time_stages(matcher, texts)
+            if best_seconds is None:
+                best_seconds, best_latencies = seconds, latencies
+                continue
+            best_seconds = {
+                stage: min(best_seconds[stage], seconds[stage])
+                for stage in STAGES
+            }
+            if sum(latencies) < sum(best_latencies):
+                best_latencies = latencies
+    finally:
+        # leveldb databases can only be opened once at the time
+        matcher.cuisem_db.close()
+        matcher = None
+
+    return {
+        'backend': backend,
+        'window': window,
+        'threshold': threshold,
+        'similarity': similarity,
+        'stages': {
+            stage: {
+                'seconds': best_seconds[stage],
+                'ms_per_doc': best_seconds[stage] / len(texts) * 1000,
+                'items': items[stage],
+                'items_per_second': (
+                    items[stage] / best_seconds[stage]
+                    if best_seconds[stage] > 0 else None
+                )
+            }
+            for stage in STAGES
+        },
+        'latency_ms': {
+            'p50': percentile(best_latencies, 0.5) * 1000,
+            'p95': percentile(best_latencies, 0.95) * 1000,
+            'p99': percentile(best_latencies, 0.99) * 1000,
+            'max': max(best_latencies) * 1000
+        },
+        'docs_per_second': len(texts) / sum(best_latencies)
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def config_key(result):
+    return (
+        result['backend'], result['window'], result['threshold'],
+        result['similarity']
+    )
+
+
+def print_results(results):
+    print('{:<8} {:>3} {:>5} {:<8} '.format('backend', 'win', 'thr', 'sim') +
+          ' '.join('{:>12}'.format(stage) for stage in STAGES) +
+          '  {:>8}'.format('p99'))
+    for result in results:
+        print(
+            '{:<8} {:>3} {:>5} {:<8} '.format(*config_key(result)) +
+            ' '.join(
+                '{:>12.3f}'.format(result['stages'][stage]['ms_per_doc'])
+                for stage in STAGES
+            ) +
+            '  {:>8.2f}'.format(result['latency_ms']['p99'])
+        )
+    print('(milliseconds per document)')
+
+
+def compare(before_fp, after_fp):
+    """Print the ratio between the time of each stage in two runs"""
+    with io.open(before_fp, encoding='utf-8') as f:
+        before = {config_key(r): r for r in json.load(f)['results']}
+    with io.open(after_fp, encoding='utf-8') as f:
+        after = {config_key(r): r for r in json.load(f)['results']}
+
+    # runs of older versions of the suite might time other stages
+    stages = [
+        stage for stage in STAGES
+        if all(
+            stage in result['stages']
+            for result in list(before.values()) + list(after.values())
+        )
+    ]
+
+    print('{:<8} {:>3} {:>5} {:<8} '.format('backend', 'win', 'thr', 'sim') +
+          ' '.join('{:>12}'.format(stage) for stage in stages))
+    for key in sorted(set(before) & set(after)):
+        print(
+            '{:<8} {:>3} {:>5} {:<8} '.format(*key) +
+            ' '.join(
+                '{:>11.2f}x'.format(
+                    after[key]['stages'][stage]['seconds'] /
+                    before[key]['stages'][stage]['seconds']
+                    if before[key]['stages'][stage]['seconds'] > 0
+                    else float('nan')
+                )
+                for stage in stages
+            )
+        )
+    print('(time after / time before; lower is faster)')
+
+
+def parse_args():
+    ap = ArgumentParser(
+        description='Benchmark the QuickUMLS matching hot path on a '
+                    'synthetic UMLS installation'
+    )
+    ap.add_argument(
+        '-o', '--output', default=None,
+        help='write results as JSON to this file'
+    )
+    ap.add_argument(
+        '--compare', nargs=2, metavar=('BEFORE', 'AFTER'), default=None,
+        help='compare two result files instead of running the benchmark'
+    )
+    ap.add_argument(
+        '-d', '--workdir',
+        default=os.path.join(tempfile.gettempdir(), 'quickumls-benchmark'),
+        help='directory for the synthetic UMLS and its installations; '
+             'they are reused across runs with the same data options'
+    )
+    ap.add_argument(
+        '--rebuild', action='store_true',
+        help='generate and install the synthetic UMLS even if it exists'
+    )
+    ap.add_argument(
+        '-b', '--backends', nargs='+', default=['leveldb', 'unqlite'],
+        choices=['leveldb', 'unqlite', 'mmap']
+    )
+    ap.add_argument('-w', '--windows', nargs='+', type=int, default=[3, 5])
+    ap.add_argument(
+        '-t', '--thresholds', nargs='+', type=float, default=[0.7, 0.9]
+    )
+    ap.add_argument(
+        '-s', '--similarities', nargs='+', default=['jaccard', 'cosine'],
+        choices=['dice', 'jaccard', 'cosine', 'overlap']
+    )
+    ap.add_argument(
+        '-c', '--n-concepts', type=int, default=20000,
+        help='number of concepts in the synthetic UMLS'
+    )
+    ap.add_argument(
+        '-n', '--n-docs', type=int, default=200,
+        help='number of synthetic documents'
+    )
+    ap.add_argument(
+        '-l', '--doc-length', type=int, default=200,
+        help='number of tokens in each synthetic document'
+    )
+    ap.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='number of times each configuration is timed (the fastest '
+             'time of each stage is kept)'
+    )
+    ap.add_argument('--seed', type=int, default=0)
+    return ap.parse_args()
+
+
+def main():
+    opts = parse_args()
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    texts, install_seconds = prepare_data(opts)
+    nlp = spacy.blank('en')
+
+    results = []
+    configs = list(itertools.product(
+        opts.backends, opts.windows, opts.thresholds, opts.similarities
+    ))
+    for i, (backend, window, threshold, similarity) in enumerate(configs):
+        print('[{}/{}] {} window={} threshold={} similarity={}'.format(
+            i + 1, len(configs), backend, window, threshold, similarity
+        ), file=sys.stderr)
+        results.append(run_config(
+            os.path.join(opts.workdir, backend), nlp, texts, backend,
+            window, threshold, similarity, opts.repeat
+        ))
+
+    print_results(results)
+
+    if opts.output:
+        with io.open(opts.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'commit': get_commit(),
+                    'quickumls': __version__,
+                    'python': platform.python_version(),
+                    'spacy': spacy.__version__,
+                    'platform': platform.platform(),
+                    'date': datetime.datetime.now().isoformat(),
+                    'options': vars(opts),
+                    'install_seconds': install_seconds
+                },
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''Synthetic UMLS releases and documents, used by the benchmark suite and
+by the tests.
+
+Concepts are made of random pronounceable words, so that no UMLS license
+is needed; the generated MRCONSO.RRF and MRSTY.RRF can be installed with
+quickumls.install (see install).
+'''
+from __future__ import unicode_literals, division, print_function
+
+import io
+import os
+import sys
+import time
+import random
+import shutil
+import subprocess
+
+import quickumls
+from quickumls.constants import ACCEPTED_SEMTYPES
+
+
+STOPWORDS = ['the', 'of', 'and', 'with', 'in', 'no', 'for', 'a', 'to']
+
+
+def make_words(rnd, n):
+    consonants = 'bcdfghlmnprstvz'
+    vowels = 'aeiou'
+    words = set()
+    while len(words) < n:
+        words.add(''.join(
+            rnd.choice(consonants) + rnd.choice(vowels)
+            for _ in range(rnd.randint(2, 4))
+        ))
+    return sorted(words)
+
+
+def make_umls(path, n_concepts, seed, extra_terms=()):
+    """Write a synthetic MRCONSO.RRF and MRSTY.RRF to path; returns the
+    vocabulary and the terms of all concepts. Each of extra_terms is added
+    as a concept of its own, after the random ones."""
+    rnd = random.Random(seed)
+    vocab = make_words(rnd, 4000)
+    semtypes = sorted(ACCEPTED_SEMTYPES) + ['T{:03d}'.format(i) for i in (
+        71, 72, 73, 77, 78, 79, 80, 81, 82, 89, 90, 93, 95
+    )]
+    terms = []
+
+    mrconso = io.open(os.path.join(path, 'MRCONSO.RRF'), 'w', encoding='utf-8')
+    mrsty = io.open(os.path.join(path, 'MRSTY.RRF'), 'w', encoding='utf-8')
+
+    with mrconso, mrsty:
+        for i in range(n_concepts):
+            cui = 'C{:07d}'.format(i + 1)
+
+            for j in range(rnd.randint(1, 4)):
+                term = ' '.join(
+                    rnd.choice(vocab) for _ in range(rnd.randint(1, 4))
+                )
+                if rnd.random() < 0.1:
+                    term = term.upper()
+                terms.append(term)
+
+                mrconso.write(
+                    '{}|{}|P|L{}|PF|S{}|{}|A{}||||SRC|PT|X|{}|0|N|256|\n'.format(
+                        cui, 'ENG' if rnd.random() < 0.95 else 'SPA', i, j,
+                        'Y' if j == 0 else 'N', j, term
+                    )
+                )
+
+            for sty in rnd.sample(semtypes, rnd.randint(1, 2)):
+                mrsty.write('{}|{}|A1.2|Name|AT1|256|\n'.format(cui, sty))
+
+        for i, term in enumerate(extra_terms, start=n_concepts):
+            cui = 'C{:07d}'.format(i + 1)
+            terms.append(term)
+            mrconso.write(
+                '{}|ENG|P|L{}|PF|S0|Y|A0||||SRC|PT|X|{}|0|N|256|\n'.format(
+                    cui, i, term
+                )
+            )
+            mrsty.write('{}|T047|A1.2|Name|AT1|256|\n'.format(cui))
+
+    return vocab, terms
+
+
+def make_documents(vocab, terms, n_docs, doc_length, seed):
+    """Documents mixing concept terms (some misspelled) with other words,
+    stopwords and punctuation."""
+    rnd = random.Random(seed)
+    docs = []
+    for _ in range(n_docs):
+        tokens = []
+        while len(tokens) < doc_length:
+            p = rnd.random()
+            if p < 0.15:
+                term = rnd.choice(terms)
+                if rnd.random() < 0.3 and len(term) > 4:
+                    # swap two characters
+                    k = rnd.randrange(len(term) - 1)
+                    term = term[:k] + term[k + 1] + term[k] + term[k + 2:]
+                tokens.extend(term.split())
+            elif p < 0.35:
+                tokens.append(rnd.choice(STOPWORDS))
+            elif p < 0.4:
+                tokens.append(rnd.choice([',', '.', ';', '-', '(', ')']))
+            elif p < 0.42:
+                tokens.append(str(rnd.randint(1, 500)))
+            else:
+                tokens.append(rnd.choice(vocab))
+        docs.append(' '.join(tokens))
+    return docs
+
+
+def install(umls_dir, dest, backend, *options):
+    """Install the synthetic UMLS with quickumls.install (options are passed
+    on to it); returns the time the installation took."""
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    os.makedirs(dest)
+
+    # make sure the installer uses the same QuickUMLS being benchmarked
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(quickumls.__file__)))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+    )
+
+    start = time.time()
+    subprocess.check_call(
+        [
+            sys.executable, '-m', 'quickumls.install', umls_dir, dest,
+            '--database-backend', backend, '--skip-spacy-download',
+            '--jobs', '1'
+        ] + list(options),
+        env=env, stdout=subprocess.DEVNULL
+    )
+    return time.time() - start
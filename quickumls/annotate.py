@@ -0,0 +1,349 @@
+'''Annotate a corpus with QuickUMLS.
+
+Documents are read as a stream from a JSONL file (one JSON object per line,
+with an id and a text field) or from a plain text file (one document per
+line, identified by its line number), and matches are written to a JSONL
+file as soon as they are available:
+
+    python -m quickumls.annotate /path/to/quickumls/files docs.jsonl out.jsonl
+
+Interrupted runs can be continued with --resume: documents whose id is
+already in the output file are skipped.
+'''
+from __future__ import unicode_literals, division, print_function
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import datetime
+import collections
+from argparse import ArgumentParser
+
+from .core import QuickUMLS
+from .constants import SPACY_UNUSED_COMPONENTS
+
+
+def open_text(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return io.open(path, mode, encoding='utf-8')
+
+
+def read_documents(path, input_format, id_field, text_field):
+    """Yields (id, text) for each document in the input file"""
+    with open_text(path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            if input_format == 'text':
+                yield line_no, line.rstrip('\n')
+                continue
+
+            try:
+                doc = json.loads(line)
+                yield doc[id_field], doc[text_field]
+            except (ValueError, KeyError) as ex:
+                raise ValueError(
+                    'invalid document on line {} of {}: {!r}'.format(
+                        line_no, path, ex
+                    )
+                )
+
+
+def load_done_ids(output_fp):
+    """Returns the ids of documents in an output file, truncating the file
+    after its last complete line (the previous run might have been stopped
+    while writing)."""
+    done_ids = set()
+    valid_size = 0
+
+    with io.open(output_fp, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done_ids.add(json.loads(line.decode('utf-8'))['id'])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(line)
+
+    with io.open(output_fp, 'ab') as f:
+        f.truncate(valid_size)
+
+    return done_ids
+
+
+def to_json(doc_id, matches):
+    return json.dumps(
+        {
+            'id': doc_id,
+            'matches': [
+                [
+                    dict(
+                        candidate.to_dict(),
+                        semtypes=sorted(candidate.semtypes)
+                    )
+                    for candidate in ngram_matches
+                ]
+                for ngram_matches in matches
+            ]
+        },
+        ensure_ascii=False
+    )
+
+
+class ProgressReporter(object):
+    """Prints how many documents and ngrams are processed per second"""
+
+    def __init__(self, every):
+        self.every = every
+        self.start = self.last_report = time.time()
+        self.docs = 0
+        self.ngrams = 0
+
+    def update(self, docs, ngrams, force=False):
+        self.docs = docs
+        self.ngrams = ngrams
+
+        now = time.time()
+        if not force and now - self.last_report < self.every:
+            return False
+        self.last_report = now
+
+        delta = max(now - self.start, 1e-6)
+        print(
+            '[{}] {:,} documents ({:,.1f} docs/s, {:,.0f} ngrams/s)'.format(
+                datetime.datetime.now().isoformat(), self.docs,
+                self.docs / delta, self.ngrams / delta
+            ),
+            file=sys.stderr
+        )
+        return True
+
+
+def annotate(matcher, documents, output, opts):
+    # ids of documents sent to the matcher, in order; texts are consumed
+    # lazily, so only ids of documents being processed are kept here
+    ids = collections.deque()
+
+    def texts():
+        for doc_id, text in documents:
+            ids.append(doc_id)
+            yield text
+
+    if opts.jobs > 1:
+        from .parallel import ParallelQuickUMLS
+
+        pool = ParallelQuickUMLS(matcher, n_workers=opts.jobs)
+        results = pool.match(
+            texts(), best_match=not opts.all_matches,
+            ignore_syntax=opts.ignore_syntax, chunksize=opts.chunksize
+        )
+
+        def ngram_count():
+            return pool.ngram_count
+    else:
+        pool = None
+        results = matcher.match_batch(
+            texts(), best_match=not opts.all_matches,
+            ignore_syntax=opts.ignore_syntax, batch_size=opts.batch_size
+        )
+
+        def ngram_count():
+            return matcher.get_stats()['ngrams']
+
+    reporter = ProgressReporter(opts.report_every)
+    ngram_start = ngram_count()
+    cnt = 0
+
+    try:
+        for matches in results:
+            output.write(to_json(ids.popleft(), matches))
+            output.write('\n')
+            cnt += 1
+
+            if reporter.update(cnt, ngram_count() - ngram_start):
+                output.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+        output.flush()
+
+    reporter.update(cnt, ngram_count() - ngram_start, force=True)
+    return cnt
+
+
+def parse_args():
+    ap = ArgumentParser(
+        prog='python -m quickumls.annotate',
+        description='Annotate a corpus with QuickUMLS, writing matches '
+                    'for each document as a line of a JSONL file.'
+    )
+    ap.add_argument(
+        'quickumls_fp',
+        help='directory where the QuickUMLS data files are installed.'
+    )
+    ap.add_argument(
+        'input_fp',
+        help='JSONL or text file with documents ("-" for stdin); files '
+             'ending in .gz are decompressed on the fly'
+    )
+    ap.add_argument('output_fp', help='JSONL output file ("-" for stdout)')
+    ap.add_argument(
+        '-f', '--input-format', choices=['jsonl', 'text'], default=None,
+        help='format of the input; by default, inputs ending in .jsonl '
+             '(or .jsonl.gz) are JSONL, and anything else is text with '
+             'one document per line'
+    )
+    ap.add_argument(
+        '--id-field', default='id',
+        help='field with the document id in JSONL inputs'
+    )
+    ap.add_argument(
+        '--text-field', default='text',
+        help='field with the document text in JSONL inputs'
+    )
+    ap.add_argument(
+        '-R', '--resume', action='store_true',
+        help='append to an existing output file, skipping documents '
+             'already in it'
+    )
+    ap.add_argument(
+        '-j', '--jobs', default=1, type=int,
+        help='number of matching processes; more than one requires an '
+             'installation that does not use leveldb'
+    )
+    ap.add_argument(
+        '-b', '--batch-size', default=1000, type=int,
+        help='number of documents processed together by spaCy (with '
+             '--jobs 1)'
+    )
+    ap.add_argument(
+        '--chunksize', default=64, type=int,
+        help='number of documents sent to a process at once (with '
+             '--jobs greater than 1)'
+    )
+    ap.add_argument(
+        '--report-every', default=10, type=float,
+        help='seconds between progress reports'
+    )
+    ap.add_argument(
+        '-a', '--all-matches', action='store_true',
+        help='return all overlapping candidates instead of the best match'
+    )
+    ap.add_argument(
+        '-i', '--ignore-syntax', action='store_true',
+        help='disable the syntax heuristics when generating ngrams'
+    )
+    ap.add_argument(
+        '-t', '--threshold', default=0.7, type=float,
+        help='minimum similarity value between strings'
+    )
+    ap.add_argument(
+        '-o', '--overlapping_criteria', default='score',
+        choices=['score', 'length'],
+        help='criteria used to deal with overlapping concepts'
+    )
+    ap.add_argument(
+        '-s', '--similarity_name', default='jaccard',
+        choices=['dice', 'jaccard', 'cosine', 'overlap'],
+        help='name of similarity to use'
+    )
+    ap.add_argument(
+        '-w', '--window', default=5, type=int,
+        help='maximum number of tokens to consider for matching'
+    )
+    ap.add_argument(
+        '-l', '--min-match-length', default=3, type=int,
+        help='minimum length of a match'
+    )
+    ap.add_argument(
+        '-u', '--keep_uppercase', action='store_true',
+        help='do not convert uppercase strings to lowercase'
+    )
+    ap.add_argument(
+        '--max-candidates', default=None, type=int,
+        help='maximum number of similar terms whose concepts are looked up '
+             'for each ngram (default: no limit)'
+    )
+    ap.add_argument(
+        '--spacy-exclude', nargs='*', default=SPACY_UNUSED_COMPONENTS,
+        help='components of the spaCy pipeline that are not loaded '
+             '(default: {}, which QuickUMLS does not use)'.format(
+                 ' '.join(SPACY_UNUSED_COMPONENTS))
+    )
+    opts = ap.parse_args()
+
+    if opts.input_format is None:
+        is_jsonl = opts.input_fp.endswith(('.jsonl', '.jsonl.gz'))
+        opts.input_format = 'jsonl' if is_jsonl else 'text'
+
+    if opts.resume and opts.output_fp == '-':
+        ap.error('--resume requires an output file')
+
+    if (
+        not opts.resume and opts.output_fp != '-' and
+        os.path.exists(opts.output_fp)
+    ):
+        ap.error(
+            '{} already exists; use --resume to continue annotating '
+            'it, or remove it'.format(opts.output_fp)
+        )
+
+    return opts
+
+
+def main():
+    opts = parse_args()
+
+    done_ids = set()
+    if opts.resume and os.path.exists(opts.output_fp):
+        done_ids = load_done_ids(opts.output_fp)
+        print(
+            '[{}] resuming: {:,} documents already annotated'.format(
+                datetime.datetime.now().isoformat(), len(done_ids)
+            ),
+            file=sys.stderr
+        )
+
+    documents = read_documents(
+        opts.input_fp, opts.input_format, opts.id_field, opts.text_field
+    )
+    if done_ids:
+        documents = (
+            (doc_id, text) for doc_id, text in documents
+            if doc_id not in done_ids
+        )
+
+    matcher = QuickUMLS(
+        opts.quickumls_fp,
+        threshold=opts.threshold,
+        overlapping_criteria=opts.overlapping_criteria,
+        similarity_name=opts.similarity_name,
+        window=opts.window,
+        min_match_length=opts.min_match_length,
+        keep_uppercase=opts.keep_uppercase,
+        result_format='object',
+        spacy_exclude=opts.spacy_exclude,
+        max_candidates=opts.max_candidates
+    )
+
+    output = open_text(opts.output_fp, 'a' if opts.resume else 'w')
+    try:
+        annotate(matcher, documents, output, opts)
+    except ValueError as ex:
+        print('[ERROR] {}'.format(ex), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
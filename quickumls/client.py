@@ -2,7 +2,12 @@ from .network import MinimalClient
 from .core import QuickUMLS
 
 
-def get_quickumls_client(host='localhost', port=4645):
-    '''Return a client for a QuickUMLS server running on host at port'''
-    client = MinimalClient(QuickUMLS, host=host, port=port, buffersize=4096)
+def get_quickumls_client(host='localhost', port=4645, protocol='chunked',
+                         pool_size=4):
+    '''Return a client for a QuickUMLS server running on host at port;
+    see network.MinimalClient for protocol and pool_size.'''
+    client = MinimalClient(
+        QuickUMLS, host=host, port=port, buffersize=4096,
+        protocol=protocol, pool_size=pool_size
+    )
     return client
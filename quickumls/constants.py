@@ -186,6 +186,10 @@ DOMAIN_SPECIFIC_STOPWORDS = {
     'time'
 }
 
+# components of the spaCy pipelines that QuickUMLS doesn't use; they can
+# be excluded when loading the pipeline (see QuickUMLS's spacy_exclude).
+SPACY_UNUSED_COMPONENTS = ['parser', 'ner']
+
 SPACY_LANGUAGE_MAP = {
     'ENG': 'en_core_web_sm',
     'GER': 'de_core_news_sm',
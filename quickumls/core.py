@@ -5,12 +5,15 @@ from __future__ import (
 # built in modules
 import os
 import sys
+import time
+import json
+import heapq
 import datetime
+import itertools
+import collections
 from six.moves import xrange
 
 # installed modules
-import spacy
-import nltk
 from unidecode import unidecode
 
 # project modules
@@ -27,7 +30,10 @@ class QuickUMLS(object):
             similarity_name='jaccard', min_match_length=3,
             accepted_semtypes=constants.ACCEPTED_SEMTYPES,
             verbose=False, keep_uppercase=False,
-            spacy_component = False):
+            spacy_component = False, ngram_cache_size=50000,
+            result_format='dict', spacy_exclude=None,
+            document_cache_size=0, document_cache_fp=None,
+            max_candidates=None):
         """Instantiate QuickUMLS object
 
             This is the main interface through which text can be processed.
@@ -53,6 +59,37 @@ class QuickUMLS(object):
                     distinguishing acronyms from normal words. For this the
                     database should be installed without the -L option.
                     Defaults to False.
+            ngram_cache_size (int, optional): Number of normalized ngrams
+                    for which candidate concepts are cached, so that
+                    repeated ngrams do not query the databases again.
+                    Set to 0 to disable caching. Defaults to 50000.
+            result_format (str, optional): One of "dict" or "object".
+                    Matches are returned as dictionaries or, if "object",
+                    as toolbox.MatchCandidate objects, which have the same
+                    fields but use less memory (use toolbox.to_dicts to
+                    convert them). Defaults to 'dict'.
+            spacy_exclude (List[str], optional): Names of components of
+                    the spaCy pipeline that are not loaded, to start faster
+                    and tokenize text faster. QuickUMLS doesn't use the
+                    parser and the named entity recognizer, so these can
+                    be constants.SPACY_UNUSED_COMPONENTS. Defaults to None
+                    (the whole pipeline is loaded).
+            document_cache_size (int, optional): Number of documents
+                    whose matches are cached in memory, so that repeated
+                    documents are not matched again. Documents are
+                    identified by a hash of their text and of the matcher
+                    options. Defaults to 0 (no caching).
+            max_candidates (int, optional): Maximum number of terms
+                    retrieved for an ngram whose concepts are looked up;
+                    if more terms are retrieved, only the most similar
+                    are kept. This bounds the cost of short ngrams, which
+                    can be similar to many terms (e.g., with the
+                    "overlap" similarity). Defaults to None (no limit).
+            document_cache_fp (str, optional): Path of a SQLite database
+                    where matches of documents are also cached, so that
+                    they persist across runs and processes. It must be
+                    removed if the QuickUMLS installation changes.
+                    Defaults to None.
 
         Raises:
             ValueError: Raises a ValueError if QuickUMLS was installed for a language that is not currently supported TODO: verify this?
@@ -77,8 +114,14 @@ class QuickUMLS(object):
         assert not(valid_similarities in valid_similarities), err_msg
         self.similarity_name = similarity_name
 
-        simstring_fp = os.path.join(quickumls_fp, 'umls-simstring.db')
-        cuisem_fp = os.path.join(quickumls_fp, 'cui-semtypes.db')
+        valid_formats = {'dict', 'object'}
+        err_msg = ('"{}" is not a valid result format. Choose between '
+                   '{}'.format(result_format, ', '.join(valid_formats)))
+        assert result_format in valid_formats, err_msg
+        self.result_format = result_format
+
+        self._simstring_fp = os.path.join(quickumls_fp, 'umls-simstring.db')
+        self._cuisem_fp = os.path.join(quickumls_fp, 'cui-semtypes.db')
 
         self.valid_punct = constants.UNICODE_DASHES
         self.negations = constants.NEGATIONS
@@ -103,12 +146,7 @@ class QuickUMLS(object):
                              '--keep_uppercase.')
 
         language_fp = os.path.join(quickumls_fp, 'language.flag')
-
-        # download stopwords if necessary
-        try:
-            nltk.corpus.stopwords.words()
-        except LookupError:
-            nltk.download('stopwords')
+        stopwords_fp = os.path.join(quickumls_fp, toolbox.STOPWORDS_FILE)
 
         if os.path.exists(language_fp):
             with open(language_fp) as f:
@@ -122,9 +160,14 @@ class QuickUMLS(object):
             self._stopwords = set()
             spacy_lang = 'XXX'
         else:
-            self._stopwords = set(
-                nltk.corpus.stopwords.words(constants.LANGUAGES[self.language_flag])
-            )
+            if os.path.exists(stopwords_fp):
+                # saved at install time, so nltk is not needed here
+                with open(stopwords_fp, encoding='utf-8') as f:
+                    self._stopwords = set(f.read().split())
+            else:
+                self._stopwords = set(toolbox.get_stopwords(
+                    constants.LANGUAGES[self.language_flag]
+                ))
             spacy_lang = constants.SPACY_LANGUAGE_MAP[self.language_flag]
 
         database_backend_fp = os.path.join(quickumls_fp, 'database_backend.flag')
@@ -140,20 +183,72 @@ class QuickUMLS(object):
                   file=sys.stderr)
             self._database_backend = 'leveldb'
 
+        # installations created before the compact format was introduced
+        # have no format flag and store pickled records.
+        database_format_fp = os.path.join(quickumls_fp, 'database_format.flag')
+        if os.path.exists(database_format_fp):
+            with open(database_format_fp) as f:
+                self._database_format, _, format_version = (
+                    f.read().strip().partition(':')
+                )
+            if (
+                self._database_format == 'compact' and
+                int(format_version) > toolbox.COMPACT_FORMAT_VERSION
+            ):
+                raise ValueError(
+                    'This installation was created with a newer version of '
+                    'QuickUMLS (compact database format v.{}); please '
+                    'upgrade QuickUMLS to use it.'.format(format_version)
+                )
+        else:
+            self._database_format = 'pickle'
+
         # domain specific stopwords
         self._stopwords = self._stopwords.union(constants.DOMAIN_SPECIFIC_STOPWORDS)
 
         self._info = None
 
+        self._ngram_cache = (
+            toolbox.LRUCache(ngram_cache_size) if ngram_cache_size > 0
+            else None
+        )
+        self._normalize_cache = (
+            toolbox.LRUCache(ngram_cache_size) if ngram_cache_size > 0
+            else None
+        )
+
+        # number of ngrams looked up since the matcher was created
+        self._ngram_count = 0
+
+        # used by match_stream if the pipeline doesn't split sentences
+        self._sentencizer = None
+        self._sentence_end_chars = None
+
+        self._document_cache = (
+            toolbox.DocumentCache(document_cache_size, document_cache_fp)
+            if document_cache_size > 0 or document_cache_fp is not None
+            else None
+        )
+        self._document_cache_options = None
+
         self.accepted_semtypes = accepted_semtypes
 
+        assert max_candidates is None or max_candidates > 0, (
+            'max_candidates must be a positive integer or None'
+        )
+        self.max_candidates = max_candidates
+
         # if this is not being executed as as spacy component, then it must be standalone
         if spacy_component:
             # In this case, the pipeline is external to this current class
             self.nlp = None
         else:
+            # spaCy is slow to import, and not needed by clients or
+            # when QuickUMLS is a component of an existing pipeline
+            import spacy
+
             try:
-                self.nlp = spacy.load(spacy_lang)
+                self.nlp = spacy.load(spacy_lang, exclude=spacy_exclude or [])
             except OSError:
                 msg = (
                     'Model for language "{}" is not downloaded. Please '
@@ -165,12 +260,48 @@ class QuickUMLS(object):
                 )
                 raise OSError(msg)
 
-        self.ss_db = toolbox.SimstringDBReader(
-            simstring_fp, similarity_name, threshold
+        self._open_databases()
+
+    def _open_databases(self):
+        """(Re)open the simstring and CUI/semantic types databases.
+
+            Handles to the databases must not be shared between processes,
+            so they are reopened when they are first used by a process
+            other than the one that opened them (e.g., a forked worker of
+            `quickumls.parallel` or of `nlp.pipe`), or after the matcher
+            has been unpickled.
+        """
+        self._ss_db = toolbox.SimstringDBReader(
+            self._simstring_fp, self.similarity_name, self.threshold
         )
-        self.cuisem_db = toolbox.CuiSemTypesDB(
-            cuisem_fp, database_backend=self._database_backend
+        self._cuisem_db = toolbox.CuiSemTypesDB(
+            self._cuisem_fp, database_backend=self._database_backend,
+            database_format=self._database_format
         )
+        self._databases_pid = os.getpid()
+
+    @property
+    def ss_db(self):
+        if self._databases_pid != os.getpid():
+            self._open_databases()
+        return self._ss_db
+
+    @property
+    def cuisem_db(self):
+        if self._databases_pid != os.getpid():
+            self._open_databases()
+        return self._cuisem_db
+
+    def __getstate__(self):
+        # database handles and caches are not pickled; databases are
+        # reopened the first time they are used after unpickling.
+        state = self.__dict__.copy()
+        state['_ss_db'] = state['_cuisem_db'] = None
+        state['_databases_pid'] = None
+        for name in ('_ngram_cache', '_normalize_cache'):
+            if state[name] is not None:
+                state[name] = toolbox.LRUCache(state[name].maxsize)
+        return state
 
     def get_info(self):
         """Computes a summary of the matcher options.
@@ -183,6 +314,30 @@ class QuickUMLS(object):
     def get_accepted_semtypes(self):
         return self.accepted_semtypes
 
+    def get_stats(self):
+        """Returns usage statistics of the matcher.
+
+        Returns:
+            Dict: Dictionary containing the number of ngrams looked up so
+                far, and the size, capacity, hits and misses of the ngram
+                and normalization caches (None if caching is disabled).
+        """
+        return {
+            'ngrams': self._ngram_count,
+            'ngram_cache': (
+                self._ngram_cache.stats() if self._ngram_cache is not None
+                else None
+            ),
+            'normalize_cache': (
+                self._normalize_cache.stats()
+                if self._normalize_cache is not None else None
+            ),
+            'document_cache': (
+                self._document_cache.stats()
+                if self._document_cache is not None else None
+            )
+        }
+
     @property
     def info(self):
         """Computes a summary of the matcher options.
@@ -199,9 +354,14 @@ class QuickUMLS(object):
                 'window': self.window,
                 'ngram_length': self.ngram_length,
                 'min_match_length': self.min_match_length,
-                'accepted_semtypes': sorted(self.accepted_semtypes),
+                'accepted_semtypes': (
+                    None if self.accepted_semtypes is None
+                    else sorted(self.accepted_semtypes)
+                ),
                 'negations': sorted(self.negations),
-                'valid_punct': sorted(self.valid_punct)
+                'valid_punct': sorted(self.valid_punct),
+                'result_format': self.result_format,
+                'max_candidates': self.max_candidates
             }
         return self._info
 
@@ -247,26 +407,26 @@ class QuickUMLS(object):
     def _make_ngrams(self, sent):
         sent_length = len(sent)
 
-        # do not include determiners inside a span
-        skip_in_span = {token.i for token in sent if token.pos_ == 'DET'}
+        # token features are computed once per token, rather than
+        # once for every span the token is part of.
+        is_valid = [self._is_valid_token(tok) for tok in sent]
+        is_valid_start = [self._is_valid_start_token(tok) for tok in sent]
+        is_valid_end = [self._is_valid_end_token(tok) for tok in sent]
+        starts = [tok.idx for tok in sent]
+        ends = [tok.idx + len(tok) for tok in sent]
 
-        # invalidate a span if it includes any on these symbols
-        invalid_mid_tokens = {
-            token.i for token in sent if not self._is_valid_middle_token(token)
-        }
+        # do not include determiners inside a span
+        texts_in_span = [
+            '' if tok.pos_ == 'DET' else tok.text_with_ws for tok in sent
+        ]
 
         for i in xrange(sent_length):
-            tok = sent[i]
-
-            if not self._is_valid_token(tok):
+            if not is_valid[i]:
                 continue
 
             # do not consider this token by itself if it is
             # a number or a stopword.
-            if self._is_valid_start_token(tok):
-                compensate = False
-            else:
-                compensate = True
+            compensate = not is_valid_start[i]
 
             span_end = min(sent_length, i + self.window) + 1
 
@@ -274,104 +434,278 @@ class QuickUMLS(object):
             # in the sentence
             if (
                 i + 1 == sent_length and            # it's the last token
-                self._is_valid_end_token(tok) and   # it's a valid end token
-                len(tok) >= self.min_match_length   # it's of miminum length
+                is_valid_end[i] and                 # it's a valid end token
+                ends[i] - starts[i] >= self.min_match_length
             ):
-                yield(tok.idx, tok.idx + len(tok), tok.text)
+                yield (starts[i], ends[i], sent[i].text)
+
+            # text of the span is extended one token at the time
+            span_text = ''
 
             for j in xrange(i + 1, span_end):
+                span_text += texts_in_span[j - 1]
+
                 if compensate:
                     compensate = False
                     continue
 
-                if sent[j - 1] in invalid_mid_tokens:
-                    break
+                if not is_valid_end[j - 1]:
+                    continue
 
-                if not self._is_valid_end_token(sent[j - 1]):
+                if ends[j - 1] - starts[i] < self.min_match_length:
                     continue
 
-                span = sent[i:j]
+                yield (starts[i], ends[j - 1], span_text.strip())
+
+    def _get_semtypes_mask(self):
+        """Bitmask of the accepted semantic types, used to filter concepts
+        in the database; None if the database doesn't support it or all
+        semantic types are accepted."""
+        if (
+            self.accepted_semtypes is None or
+            not self.cuisem_db.supports_semtypes_mask
+        ):
+            return None
+        return toolbox.semtypes_to_mask(
+            self.accepted_semtypes, ignore_invalid=True
+        )
 
-                if not self._is_longer_than_min(span):
-                    continue
+    def _normalize_ngram(self, ngram):
+        """Normalize an ngram as concept terms were during installation.
 
-                yield (
-                    span.start_char, span.end_char,
-                    ''.join(token.text_with_ws for token in span
-                            if token.i not in skip_in_span).strip()
-                )
+        Returns:
+            Tuple: the ngram as compared with concept terms, and the same
+                string in the unicode normal form used to query the
+                databases.
+        """
+        if self._normalize_cache is not None:
+            normalized = self._normalize_cache.get(ngram)
+            if normalized is not None:
+                return normalized
 
-    def _get_all_matches(self, ngrams):
-        matches = []
-        for start, end, ngram in ngrams:
-            ngram_normalized = ngram
+        ngram_normalized = ngram
+
+        if self.normalize_unicode_flag:
+            ngram_normalized = unidecode(ngram_normalized)
 
-            if self.normalize_unicode_flag:
-                ngram_normalized = unidecode(ngram_normalized)
+        # make it lowercase
+        if self.to_lowercase_flag:
+            ngram_normalized = ngram_normalized.lower()
 
-            # make it lowercase
-            if self.to_lowercase_flag:
-                ngram_normalized = ngram_normalized.lower()
+        # If the term is all uppercase, it might be the case that
+        # no match is found; so we convert to lowercase;
+        # however, this is never needed if the string is lowercased
+        # in the step above
+        if not self.to_lowercase_flag and ngram_normalized.isupper() and not self.keep_uppercase:
+            ngram_normalized = ngram_normalized.lower()
 
-            # If the term is all uppercase, it might be the case that
-            # no match is found; so we convert to lowercase;
-            # however, this is never needed if the string is lowercased
-            # in the step above
-            if not self.to_lowercase_flag and ngram_normalized.isupper() and not self.keep_uppercase:
-                ngram_normalized = ngram_normalized.lower()
+        normalized = (ngram_normalized, toolbox.safe_unicode(ngram_normalized))
 
-            prev_cui = None
-            ngram_cands = list(self.ss_db.get(ngram_normalized))
+        if self._normalize_cache is not None:
+            self._normalize_cache.put(ngram, normalized)
 
-            ngram_matches = []
+        return normalized
+
+    def _get_ngram_candidates(
+            self, ngram_normalized, semtypes_mask=None, ngram_query=None,
+            stats=None):
+        """Retrieve, score and filter the concepts matching an ngram.
+
+        Args:
+            ngram_normalized (str): ngram to compare with concept terms.
+            semtypes_mask (int, optional): Bitmask of the accepted
+                semantic types, if supported by the database.
+            ngram_query (str, optional): ngram_normalized in the unicode
+                normal form of the databases (see _normalize_ngram).
+                Computed from ngram_normalized if not provided.
+            stats (toolbox.MatchStats, optional): If provided, timings and
+                counters are added to it.
+
+        Returns:
+            List: (term, cui, similarity, semtypes, preferred) tuples,
+                best candidates first.
+        """
+        if ngram_query is None:
+            ngram_query = toolbox.safe_unicode(ngram_normalized)
 
-            for match in ngram_cands:
-                cuisem_match = sorted(self.cuisem_db.get(match))
+        if stats is not None:
+            start = time.perf_counter()
 
-                match_similarity = toolbox.get_similarity(
-                    x=ngram_normalized,
-                    y=match,
-                    n=self.ngram_length,
-                    similarity_name=self.similarity_name
+        prev_cui = None
+        ss_db = self.ss_db
+        cuisem_db = self.cuisem_db
+
+        # queries that no term is long or short enough to match are
+        # skipped, based on the sizes of the terms in the database
+        if ss_db.can_match(ngram_query):
+            ngram_cands = list(ss_db.get(ngram_query, normalized=True))
+        else:
+            ngram_cands = []
+            if stats is not None:
+                stats.incr('queries_skipped')
+
+        if stats is not None:
+            retrieved = time.perf_counter()
+            stats.add_time('simstring', retrieved - start)
+            stats.incr('candidates_retrieved', len(ngram_cands))
+
+        # all candidates are scored at once, so that the ngrams of
+        # ngram_normalized are only extracted once
+        similarities = toolbox.get_similarities(
+            x=ngram_normalized,
+            ys=ngram_cands,
+            n=self.ngram_length,
+            similarity_name=self.similarity_name
+        )
+
+        if (
+            self.max_candidates is not None and
+            len(ngram_cands) > self.max_candidates
+        ):
+            # only the most similar terms are looked up; ties are broken
+            # by the order in which simstring returned them
+            best = sorted(heapq.nlargest(
+                self.max_candidates, range(len(ngram_cands)),
+                key=similarities.__getitem__
+            ))
+            if stats is not None:
+                stats.incr(
+                    'candidates_capped', len(ngram_cands) - len(best)
                 )
+            ngram_cands = [ngram_cands[i] for i in best]
+            similarities = [similarities[i] for i in best]
 
-                if match_similarity == 0:
-                        continue
+        if stats is not None:
+            scored = time.perf_counter()
+            stats.add_time('scoring', scored - retrieved)
+            semtypes_rejected = cuisem_db.semtypes_rejected
+
+        ngram_matches = []
+
+        for match, match_similarity in zip(ngram_cands, similarities):
+            if match_similarity == 0:
+                if stats is not None:
+                    stats.incr('rejected_by_similarity')
+                continue
+
+            # terms returned by simstring are already normalized
+            cuisem_match = sorted(
+                cuisem_db.get(match, semtypes_mask, normalized=True)
+            )
+
+            for cui, semtypes, preferred in cuisem_match:
 
-                for cui, semtypes, preferred in cuisem_match:
+                # semantic types have already been checked by the
+                # database if a mask was provided
+                if semtypes_mask is None and not self._is_ok_semtype(semtypes):
+                    if stats is not None:
+                        stats.incr('rejected_by_semtype')
+                    continue
 
-                    if not self._is_ok_semtype(semtypes):
+                if prev_cui is not None and prev_cui == cui:
+                    if match_similarity > ngram_matches[-1][2]:
+                        ngram_matches.pop(-1)
+                    else:
                         continue
 
-                    if prev_cui is not None and prev_cui == cui:
-                        if match_similarity > ngram_matches[-1]['similarity']:
-                            ngram_matches.pop(-1)
-                        else:
-                            continue
-
-                    prev_cui = cui
-
-                    ngram_matches.append(
-                        {
-                            'start': start,
-                            'end': end,
-                            'ngram': ngram,
-                            'term': toolbox.safe_unicode(match),
-                            'cui': cui,
-                            'similarity': match_similarity,
-                            'semtypes': semtypes,
-                            'preferred': preferred
-                        }
-                    )
+                prev_cui = cui
 
-            if len(ngram_matches) > 0:
-                matches.append(
-                    sorted(
-                        ngram_matches,
-                        key=lambda m: m['similarity'] + m['preferred'],
-                        reverse=True
+                ngram_matches.append(
+                    (
+                        match, cui, match_similarity,
+                        frozenset(semtypes), preferred
                     )
                 )
+
+        if stats is not None:
+            looked_up = time.perf_counter()
+            stats.add_time('cui_lookup', looked_up - scored)
+            stats.incr(
+                'rejected_by_semtype',
+                cuisem_db.semtypes_rejected - semtypes_rejected
+            )
+
+        ngram_matches = sorted(
+            ngram_matches, key=lambda m: m[2] + m[4], reverse=True
+        )
+
+        if stats is not None:
+            stats.add_time('scoring', time.perf_counter() - looked_up)
+
+        return ngram_matches
+
+    def _get_all_matches(self, ngrams, stats=None):
+        matches = []
+        ngram_count = self._ngram_count
+
+        semtypes_mask = self._get_semtypes_mask()
+
+        # cached candidates depend on these options as well as on the ngram
+        if self._ngram_cache is not None:
+            cache_settings = (
+                self.threshold, self.similarity_name,
+                None if self.accepted_semtypes is None
+                else frozenset(self.accepted_semtypes),
+                self.max_candidates
+            )
+
+        for start, end, ngram in ngrams:
+            self._ngram_count += 1
+            ngram_normalized, ngram_query = self._normalize_ngram(ngram)
+
+            if self._ngram_cache is None:
+                ngram_matches = self._get_ngram_candidates(
+                    ngram_normalized, semtypes_mask, ngram_query, stats
+                )
+            else:
+                cache_key = (cache_settings, ngram_normalized)
+                ngram_matches = self._ngram_cache.get(cache_key)
+                if ngram_matches is None:
+                    ngram_matches = self._get_ngram_candidates(
+                        ngram_normalized, semtypes_mask, ngram_query, stats
+                    )
+                    self._ngram_cache.put(cache_key, ngram_matches)
+                elif stats is not None:
+                    stats.incr('ngram_cache_hits')
+
+            if len(ngram_matches) == 0:
+                continue
+
+            if self.result_format == 'object':
+                # semantic types are frozensets, so they can be shared
+                # with the cached entries
+                matches.append([
+                    toolbox.MatchCandidate(
+                        start, end, ngram, term, cui, similarity, semtypes,
+                        preferred
+                    )
+                    for term, cui, similarity, semtypes, preferred
+                    in ngram_matches
+                ])
+            else:
+                matches.append([
+                    {
+                        'start': start,
+                        'end': end,
+                        'ngram': ngram,
+                        'term': term,
+                        'cui': cui,
+                        'similarity': similarity,
+                        # copied so callers can't alter cached entries
+                        'semtypes': set(semtypes),
+                        'preferred': preferred
+                    }
+                    for term, cui, similarity, semtypes, preferred
+                    in ngram_matches
+                ])
+
+        if stats is not None:
+            stats.incr('ngrams', self._ngram_count - ngram_count)
+            stats.incr(
+                'concepts',
+                sum(len(ngram_matches) for ngram_matches in matches)
+            )
+
         return matches
 
     @staticmethod
@@ -426,7 +760,7 @@ class QuickUMLS(object):
         )
         return True
 
-    def match(self, text, best_match=True, ignore_syntax=False):
+    def match(self, text, best_match=True, ignore_syntax=False, stats=None):
         """Perform UMLS concept resolution for the given string.
 
         [extended_summary]
@@ -436,20 +770,364 @@ class QuickUMLS(object):
 
             best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
             ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). TODO: clarify,. Defaults to False.
+            stats (toolbox.MatchStats, optional): If provided, per-stage
+                timings and counters are added to it. Defaults to None.
 
         Returns:
             List: List of all matches in the text
             TODO: Describe format
         """
 
-        parsed = self.nlp(u'{}'.format(text))
-        
+        text = u'{}'.format(text)
+
+        if self._document_cache is not None:
+            cache_key, matches = self._get_cached_matches(
+                text, best_match, ignore_syntax, stats
+            )
+            if matches is not None:
+                return matches
+
+        if stats is not None:
+            start = time.perf_counter()
+
+        parsed = self.nlp(text)
+
+        if stats is not None:
+            stats.add_time('tokenization', time.perf_counter() - start)
+
         # pass in parsed spacy doc to get concept matches
-        matches = self._match(parsed)
+        matches = self._match(
+            parsed, best_match=best_match, ignore_syntax=ignore_syntax,
+            stats=stats
+        )
+
+        if self._document_cache is not None:
+            self._document_cache.put(cache_key, matches)
 
         return matches
-        
-    def _match(self, doc, best_match=True, ignore_syntax=False):
+
+    def _get_document_cache_key(self, text, best_match, ignore_syntax):
+        if self._document_cache_options is None:
+            # info doesn't include all options that change matches
+            self._document_cache_options = json.dumps(
+                [
+                    self.info, self.overlapping_criteria,
+                    self.keep_uppercase, os.path.abspath(self._simstring_fp)
+                ],
+                sort_keys=True
+            )
+        return toolbox.DocumentCache.make_key(
+            text, '{}{:d}{:d}'.format(
+                self._document_cache_options, best_match, ignore_syntax
+            )
+        )
+
+    def _get_cached_matches(self, text, best_match, ignore_syntax, stats):
+        """Returns the cache key of text, and its cached matches (None if
+        they are not in the cache)."""
+        cache_key = self._get_document_cache_key(
+            text, best_match, ignore_syntax
+        )
+        matches = self._document_cache.get(cache_key)
+
+        if matches is not None and stats is not None:
+            stats.incr('documents')
+            stats.incr('document_cache_hits')
+            stats.incr('matches', len(matches))
+
+        return cache_key, matches
+
+    def match_batch(
+            self, texts, best_match=True, ignore_syntax=False,
+            batch_size=1000, n_process=1, stats=None):
+        """Perform UMLS concept resolution for a sequence of strings.
+
+        This is the preferred entry point when processing many documents:
+        texts are streamed through spaCy's `nlp.pipe`, which tokenizes
+        them in batches rather than one call at a time.
+
+        Args:
+            texts (Iterable[str]): Texts on which to run the algorithm;
+                can be a generator, in which case it is consumed lazily.
+            best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
+            ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). Defaults to False.
+            batch_size (int, optional): Number of texts spaCy buffers and
+                processes at once. Defaults to 1000.
+            n_process (int, optional): Number of processes spaCy uses for
+                tokenization. Defaults to 1.
+            stats (toolbox.MatchStats, optional): If provided, per-stage
+                timings and counters are added to it. Defaults to None.
+
+        Yields:
+            List: List of all matches for each text, in the same order
+                as the input texts (same format as `match`).
+        """
+
+        if self.nlp is None:
+            raise ValueError(
+                'match_batch is not available when QuickUMLS is used as '
+                'a spaCy component; use `nlp.pipe` instead.'
+            )
+
+        texts = (u'{}'.format(text) for text in texts)
+
+        if self._document_cache is not None:
+            # cached documents are not tokenized; pending holds the cache
+            # key and cached matches (if any) of texts read from the
+            # input, in order, until their matches are returned.
+            pending = collections.deque()
+            texts = self._filter_cached(
+                texts, pending, best_match, ignore_syntax, stats
+            )
+
+        docs = self.nlp.pipe(
+            texts, batch_size=batch_size, n_process=n_process
+        )
+
+        if stats is not None:
+            # documents are tokenized when they are requested from the
+            # pipe, so that's what is timed
+            docs = self._timed_iter(docs, stats, 'tokenization')
+
+        for doc in docs:
+            matches = self._match(
+                doc, best_match=best_match, ignore_syntax=ignore_syntax,
+                stats=stats
+            )
+
+            if self._document_cache is None:
+                yield matches
+                continue
+
+            # return cached matches of documents that preceded this one
+            cache_key, cached_matches = pending.popleft()
+            while cached_matches is not None:
+                yield cached_matches
+                cache_key, cached_matches = pending.popleft()
+
+            self._document_cache.put(cache_key, matches)
+            yield matches
+
+        if self._document_cache is not None:
+            for _, cached_matches in pending:
+                yield cached_matches
+
+    def _filter_cached(self, texts, pending, best_match, ignore_syntax,
+                       stats):
+        for text in texts:
+            cache_key, matches = self._get_cached_matches(
+                text, best_match, ignore_syntax, stats
+            )
+            pending.append((cache_key, matches))
+            if matches is None:
+                yield text
+
+    @staticmethod
+    def _timed_iter(iterable, stats, stage):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            stats.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def match_parallel(
+            self, texts, best_match=True, ignore_syntax=False,
+            n_workers=None, chunksize=64, max_pending=None, stats=None):
+        """Perform UMLS concept resolution for a sequence of strings using
+        a pool of worker processes.
+
+            Workers are forked from the current process, so they share the
+            spaCy model already loaded by this matcher; each one opens its
+            own read-only handles to the databases once, when it starts.
+            Requires a database backend that supports concurrent readers
+            (i.e., not leveldb). See `quickumls.parallel.ParallelQuickUMLS`
+            to reuse the same pool across several calls.
+
+        Args:
+            texts (Iterable[str]): Texts on which to run the algorithm;
+                can be a generator, in which case it is consumed lazily.
+            best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
+            ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). Defaults to False.
+            n_workers (int, optional): Number of worker processes. Defaults
+                to the number of CPUs.
+            chunksize (int, optional): Number of texts sent to a worker
+                at once. Defaults to 64.
+            max_pending (int, optional): Maximum number of chunks queued
+                or being processed at any time. Defaults to twice the
+                number of workers.
+            stats (toolbox.MatchStats, optional): If provided, per-stage
+                timings and counters of all workers are added to it (as
+                each chunk is completed). Defaults to None.
+
+        Yields:
+            List: List of all matches for each text, in the same order
+                as the input texts (same format as `match`).
+        """
+        from .parallel import ParallelQuickUMLS
+
+        with ParallelQuickUMLS(self, n_workers=n_workers) as pool:
+            for matches in pool.match(
+                    texts, best_match=best_match,
+                    ignore_syntax=ignore_syntax, chunksize=chunksize,
+                    max_pending=max_pending, stats=stats):
+                yield matches
+
+    def match_stream(
+            self, chunks, best_match=True, ignore_syntax=False,
+            max_buffer_tokens=1000, stats=None):
+        """Perform UMLS concept resolution on a stream of text.
+
+            Text is matched one sentence at the time, as soon as the
+            sentence is complete (that is, when the next one starts), so
+            matches are available before the stream ends, and memory
+            doesn't grow with the length of the text. Unlike `match`,
+            ngrams never span more than one sentence.
+
+            Text that has not been matched yet is tokenized again only
+            when a chunk might end a sentence (it contains punctuation
+            or a new line) or when the text has doubled in length since
+            it was last tokenized, so that long sentences split in many
+            chunks are not tokenized once per chunk.
+
+        Args:
+            chunks (Iterable[str]): Pieces of text, in order (e.g., the
+                output of a dictation system, or the segments of a
+                message); they are concatenated, so sentences and words
+                can be split between chunks anywhere.
+            best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
+            ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). TODO: clarify,. Defaults to False.
+            max_buffer_tokens (int, optional): Maximum number of tokens
+                of an incomplete sentence kept in memory (as text is not
+                tokenized after every chunk, up to about twice as many
+                can be kept). The beginning of longer sentences is
+                matched right away, and only their last `window` tokens
+                are carried over to be matched with the text that
+                follows. Defaults to 1000.
+            stats (toolbox.MatchStats, optional): If provided, per-stage
+                timings and counters are added to it. Defaults to None.
+
+        Yields:
+            List: Candidates for one ngram (same format as the elements
+                of the list returned by `match`), in order of position;
+                offsets are relative to the start of the stream.
+
+        Raises:
+            ValueError: if QuickUMLS is used as a spaCy component, since
+                it has no pipeline to tokenize the text.
+        """
+        if self.nlp is None:
+            raise ValueError(
+                'Streaming is not available when QuickUMLS is used as a '
+                'spaCy component.'
+            )
+
+        assert max_buffer_tokens > self.window, (
+            'max_buffer_tokens must be greater than window'
+        )
+
+        # text that has not been matched yet, and its position in the stream
+        buffer = ''
+        offset = 0
+
+        # with best_match, matches can't overlap those already emitted
+        min_start = 0
+
+        # length of the buffer when it was last tokenized
+        tokenized_length = 0
+
+        if stats is not None:
+            stats.incr('documents')
+
+        # None marks the end of the stream
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                buffer += chunk
+                if not (
+                    self._may_end_sentence(chunk) or
+                    len(buffer) >= 2 * tokenized_length
+                ):
+                    continue
+
+            if stats is not None:
+                start = time.perf_counter()
+
+            doc = self.nlp(buffer)
+            sents = self._get_sentences(doc)
+            tokenized_length = len(buffer)
+
+            if stats is not None:
+                stats.add_time('tokenization', time.perf_counter() - start)
+
+            if not sents:
+                continue
+
+            # (span, char offset before which ngrams must start) for all
+            # the text that can be matched now
+            segments = [(sent, None) for sent in sents[:-1]]
+            last = sents[-1]
+
+            if chunk is None:
+                segments.append((last, None))
+                consumed = len(buffer)
+            elif len(last) > max_buffer_tokens:
+                # ngrams starting here or later might extend past the
+                # end of the buffer, so they are matched later
+                carry_over = last[len(last) - self.window]
+                segments.append((last, carry_over.idx))
+                consumed = carry_over.idx
+            else:
+                consumed = last.start_char
+
+            for span, end in segments:
+                ngrams = (
+                    (ngram_start + offset, ngram_end + offset, ngram)
+                    for ngram_start, ngram_end, ngram in (
+                        self._make_token_sequences(span) if ignore_syntax
+                        else self._make_ngrams(span)
+                    )
+                    if (end is None or ngram_start < end) and
+                    (not best_match or ngram_start + offset >= min_start)
+                )
+
+                if stats is not None:
+                    stats.incr('tokens', len(span))
+
+                matches = self._match_ngrams(ngrams, best_match, stats)
+                matches.sort(key=lambda match: match[0]['start'])
+
+                for match in matches:
+                    min_start = max(min_start, match[0]['end'])
+                    yield match
+
+            buffer = buffer[consumed:]
+            offset += consumed
+            tokenized_length = len(buffer)
+
+    def _may_end_sentence(self, text):
+        # pipelines with a parser might end sentences elsewhere too;
+        # those are matched when more text arrives
+        if self._sentence_end_chars is None:
+            from spacy.pipeline import Sentencizer
+            self._sentence_end_chars = (
+                frozenset(Sentencizer.default_punct_chars) | {'\n'}
+            )
+        return any(char in self._sentence_end_chars for char in text)
+
+    def _get_sentences(self, doc):
+        if not doc.has_annotation('SENT_START'):
+            # the pipeline doesn't split sentences (e.g., its parser was
+            # excluded), so they are split on punctuation
+            if self._sentencizer is None:
+                from spacy.pipeline import Sentencizer
+                self._sentencizer = Sentencizer()
+            doc = self._sentencizer(doc)
+        return list(doc.sents)
+
+    def _match(self, doc, best_match=True, ignore_syntax=False, stats=None):
         """Gathers ngram matches given a spaCy document object.
 
         [extended_summary]
@@ -459,6 +1137,8 @@ class QuickUMLS(object):
 
             best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
             ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). TODO: clarify,. Defaults to False
+            stats (toolbox.MatchStats, optional): If provided, per-stage
+                timings and counters are added to it. Defaults to None.
 
         Returns:
             List: List of all matches in the text
@@ -471,11 +1151,34 @@ class QuickUMLS(object):
         else:
             ngrams = self._make_ngrams(doc)
 
-        matches = self._get_all_matches(ngrams)
+        if stats is not None:
+            stats.incr('documents')
+            stats.incr('tokens', len(doc))
+
+        matches = self._match_ngrams(ngrams, best_match, stats)
+
+        self._print_verbose_status(doc, matches)
+
+        return matches
+
+    def _match_ngrams(self, ngrams, best_match, stats):
+        if stats is not None:
+            # ngrams are generated eagerly, so that their generation is
+            # timed separately from the lookups
+            start = time.perf_counter()
+            ngrams = list(ngrams)
+            stats.add_time('ngrams', time.perf_counter() - start)
+
+        matches = self._get_all_matches(ngrams, stats)
 
         if best_match:
+            if stats is not None:
+                start = time.perf_counter()
             matches = self._select_terms(matches)
+            if stats is not None:
+                stats.add_time('selection', time.perf_counter() - start)
+
+        if stats is not None:
+            stats.incr('matches', len(matches))
 
-        self._print_verbose_status(doc, matches)
-        
         return matches
@@ -3,7 +3,12 @@ from __future__ import unicode_literals, division, print_function
 # built in modules
 import argparse
 import codecs
+import contextlib
+import datetime
+import json
+import multiprocessing
 import os
+import pickle
 from six.moves import input
 import shutil
 import sys
@@ -19,8 +24,14 @@ import spacy
 
 
 # project modules
-from .toolbox import countlines, CuiSemTypesDB, SimstringDBWriter, mkdir
-from .constants import HEADERS_MRCONSO, HEADERS_MRSTY, LANGUAGES, SPACY_LANGUAGE_MAP
+from .toolbox import (
+    CuiSemTypesDB, SimstringDBWriter, mkdir, safe_unicode, get_stopwords,
+    COMPACT_FORMAT_VERSION, STOPWORDS_FILE
+)
+from .constants import (
+    HEADERS_MRCONSO, HEADERS_MRSTY, LANGUAGES, SPACY_LANGUAGE_MAP,
+    ACCEPTED_SEMTYPES
+)
 
 
 def get_semantic_types(path, headers):
@@ -34,90 +45,271 @@ def get_semantic_types(path, headers):
     return sem_types
 
 
-def get_mrconso_iterator(path, headers, lang='ENG'):
-    with codecs.open(path, encoding='utf-8') as f:
-        for i, ln in enumerate(f):
-            content = dict(zip(headers, ln.strip().split('|')))
-
-            if content['lat'] != lang:
-                continue
+def load_semantic_types(mrsty_path, opts, headers=HEADERS_MRSTY):
+    sem_types = get_semantic_types(mrsty_path, headers)
 
-            yield content
+    # only keep concepts that belong to at least one of the semantic types
+    # selected by the user
+    if opts.semtypes is not None:
+        selected_semtypes = set(opts.semtypes)
+        sem_types = {
+            cui: stys for cui, stys in sem_types.items()
+            if selected_semtypes.intersection(stys)
+        }
 
+    return sem_types
 
-def extract_from_mrconso(
-        mrconso_path, mrsty_path, opts,
-        mrconso_header=HEADERS_MRCONSO, mrsty_header=HEADERS_MRSTY):
 
+@contextlib.contextmanager
+def timed_stage(name):
+    """Print how long the stage of the installation named name took"""
+    print('[{}] {}...'.format(datetime.datetime.now().isoformat(), name))
+    sys.stdout.flush()
     start = time.time()
-    print('loading semantic types...', end=' ')
+    yield
+    print('[{}] {} done in {:.2f} s'.format(
+        datetime.datetime.now().isoformat(), name, time.time() - start
+    ))
     sys.stdout.flush()
-    sem_types = get_semantic_types(mrsty_path, mrsty_header)
-    print('done in {:.2f} s'.format(time.time() - start))
 
-    start = time.time()
 
-    mrconso_iterator = get_mrconso_iterator(
-        mrconso_path, mrconso_header, opts.language
-    )
+class InstallCheckpoint(object):
+    """Keeps track of the completed steps of an installation, so that an
+    interrupted installation can be resumed with the same options."""
+
+    def __init__(self, destination_path, options):
+        self.path = os.path.join(destination_path, '.checkpoint')
+        self.progress_fp = os.path.join(self.path, 'progress.json')
+        mkdir(self.path)
 
-    total = countlines(mrconso_path)
+        if os.path.exists(self.progress_fp):
+            with open(self.progress_fp) as f:
+                self.progress = json.load(f)
+
+            if self.progress['options'] != options:
+                msg = (
+                    'The installation in "{}" was started with different '
+                    'options ({}); it can\'t be resumed with {}.'
+                ).format(destination_path, self.progress['options'], options)
+                raise ValueError(msg)
+        else:
+            self.progress = {'options': options}
+            self._save()
+
+    def _save(self):
+        tmp_fp = self.progress_fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_fp, self.progress_fp)
+
+    def get(self, key, default=None):
+        return self.progress.get(key, default)
+
+    def set(self, key, value):
+        self.progress[key] = value
+        self._save()
+
+    def chunk_fp(self, i):
+        return os.path.join(self.path, 'mrconso-{:05d}.pickle'.format(i))
+
+    def clear(self):
+        shutil.rmtree(self.path)
+
+
+def plan_mrconso_chunks(path, chunk_size):
+    """Split the file at path in (start, end) byte ranges of about
+    chunk_size bytes, each ending at a line boundary."""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        while offsets[-1] < size:
+            f.seek(min(offsets[-1] + chunk_size, size))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def parse_mrconso_chunk(
+        path, start, end, out_fp, lang, lowercase, normalize_unicode,
+        headers=HEADERS_MRCONSO):
+    """Extract (term, cui, preferred) tuples for concepts in language lang
+    from the lines of MRCONSO.RRF between bytes start and end, and save them
+    to out_fp. Returns the number of lines read."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').splitlines()
 
     processed = set()
-    i = 0
+    extracted = []
 
-    for content in mrconso_iterator:
-        i += 1
+    for ln in lines:
+        content = dict(zip(headers, ln.strip().split('|')))
 
-        if i % 100000 == 0:
-            delta = time.time() - start
-            status = (
-                '{:,} in {:.2f} s ({:.2%}, {:.1e} s / term)'
-                ''.format(i, delta, i / total, delta / i if i > 0 else 0)
-            )
-            print(status)
+        if content.get('lat') != lang:
+            continue
 
         concept_text = content['str'].strip()
         cui = content['cui']
         preferred = 1 if content['ispref'] == 'Y' else 0
 
-        if opts.lowercase:
+        if lowercase:
             concept_text = concept_text.lower()
 
-        if opts.normalize_unicode:
+        if normalize_unicode:
             concept_text = unidecode(concept_text)
 
+        # terms are grouped by the key they are stored with
+        concept_text = safe_unicode(concept_text)
+
         if (cui, concept_text) in processed:
             continue
         else:
             processed.add((cui, concept_text))
 
-        yield (concept_text, cui, sem_types[cui], preferred)
+        extracted.append((concept_text, cui, preferred))
 
-    delta = time.time() - start
-    status = (
-        '\nCOMPLETED: {:,} in {:.2f} s ({:.1e} s / term)'
-        ''.format(i, delta, i / total, delta / i if i > 0 else 0)
-    )
-    print(status)
+    # write to a temporary file first, so that a partially written chunk
+    # is never mistaken for a complete one when resuming
+    with open(out_fp + '.tmp', 'wb') as f:
+        pickle.dump(extracted, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(out_fp + '.tmp', out_fp)
 
+    return len(lines)
 
-def parse_and_encode_ngrams(extracted_it, simstring_dir, cuisty_dir, database_backend):
-    # Create destination directories for the two databases
-    mkdir(simstring_dir)
-    mkdir(cuisty_dir)
 
-    ss_db = SimstringDBWriter(simstring_dir)
-    cuisty_db = CuiSemTypesDB(cuisty_dir, database_backend=database_backend)
+def _parse_mrconso_chunk_star(args):
+    return parse_mrconso_chunk(*args)
+
+
+def parse_mrconso(mrconso_path, checkpoint, opts, chunk_size=64 * 2 ** 20):
+    """Parse MRCONSO.RRF in parallel, one chunk per task; chunks parsed by
+    a previous run are reused. Returns the paths of the parsed chunks."""
+    chunks = checkpoint.get('mrconso_chunks')
+    if chunks is None:
+        chunks = plan_mrconso_chunks(mrconso_path, chunk_size)
+        checkpoint.set('mrconso_chunks', chunks)
+
+    chunk_fps = [checkpoint.chunk_fp(i) for i in range(len(chunks))]
+    tasks = [
+        (
+            mrconso_path, start, end, chunk_fp, opts.language,
+            opts.lowercase, opts.normalize_unicode
+        )
+        for (start, end), chunk_fp in zip(chunks, chunk_fps)
+        if not os.path.exists(chunk_fp)
+    ]
+
+    if len(tasks) < len(chunks):
+        print('resuming: {:,} of {:,} chunks already parsed'.format(
+            len(chunks) - len(tasks), len(chunks)
+        ))
+
+    start = time.time()
+    total = sum(task[2] - task[1] for task in tasks)
+    parsed = 0
+    lines = 0
+
+    pool = multiprocessing.Pool(opts.jobs)
+    try:
+        for task, n_lines in zip(
+                tasks, pool.imap(_parse_mrconso_chunk_star, tasks)):
+            parsed += task[2] - task[1]
+            lines += n_lines
+            delta = time.time() - start
+            print('{:,} lines in {:.2f} s ({:.2%}, {:.1e} s / line)'.format(
+                lines, delta, parsed / total, delta / lines if lines else 0
+            ))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return chunk_fps
+
+
+def group_terms(chunk_fps, sem_types):
+    """Group parsed concepts by term, so that each term can be written to
+    the databases only once. Returns a dictionary mapping each term to
+    a {cui: preferred} dictionary; terms are in order of first appearance
+    in MRCONSO.RRF."""
+    terms = {}
+
+    for chunk_fp in chunk_fps:
+        with open(chunk_fp, 'rb') as f:
+            extracted = pickle.load(f)
+
+        for term, cui, preferred in extracted:
+            # concepts without semantic types (or not in the semantic
+            # types selected by the user) are skipped
+            if cui not in sem_types:
+                continue
+            terms.setdefault(term, {}).setdefault(cui, preferred)
+
+    return terms
+
+
+def write_cuisty_db(terms, sem_types, cuisty_dir, checkpoint, opts,
+                    checkpoint_every=100000, batch_size=50000):
+    """Store CUIs and semantic types of all terms, one write per term,
+    in batches of batch_size. Terms are written in sorted order, and
+    progress is saved every checkpoint_every terms so that writing can
+    be resumed."""
+
+    # the mmap index is only written to disk once complete, so
+    # it always has to be built from scratch
+    resumable = opts.database_backend != 'mmap'
+    if not resumable and os.path.exists(cuisty_dir):
+        shutil.rmtree(cuisty_dir)
+    mkdir(cuisty_dir)
 
-    simstring_terms = set()
+    cuisty_db = CuiSemTypesDB(
+        cuisty_dir, database_backend=opts.database_backend,
+        database_format=opts.database_format
+    )
 
-    for i, (term, cui, stys, preferred) in enumerate(extracted_it, start=1):
-        if term not in simstring_terms:
-            ss_db.insert(term)
-            simstring_terms.add(term)
+    with cuisty_db.bulk(max_pending=batch_size):
+        if not (resumable and checkpoint.get('cuisty_semtypes_done')):
+            cuis = {cui for term_cuis in terms.values() for cui in term_cuis}
+            for cui in sorted(cuis):
+                cuisty_db.put_semtypes(cui, sem_types[cui])
+            if resumable:
+                cuisty_db.flush()
+                checkpoint.set('cuisty_semtypes_done', True)
+
+        written = checkpoint.get('cuisty_terms_written', 0) if resumable else 0
+        if written > 0:
+            print('resuming: {:,} of {:,} terms already written'.format(
+                written, len(terms)
+            ))
+
+        start = time.time()
+        for i, term in enumerate(sorted(terms)[written:], start=written + 1):
+            cuisty_db.put_term(term, terms[term].items())
+
+            if i % checkpoint_every == 0:
+                if resumable:
+                    # pending writes must hit the disk before the
+                    # checkpoint, or they would be skipped on resume
+                    cuisty_db.flush()
+                    checkpoint.set('cuisty_terms_written', i)
+                delta = time.time() - start
+                print('{:,} terms in {:.2f} s ({:.2%}, {:.1e} s / term)'.format(
+                    i, delta, i / len(terms), delta / (i - written)
+                ))
+
+    cuisty_db.close()
+
+
+def write_simstring_db(terms, simstring_dir):
+    # the simstring database can't be appended to, so it is always
+    # written from scratch
+    if os.path.exists(simstring_dir):
+        shutil.rmtree(simstring_dir)
+    mkdir(simstring_dir)
 
-        cuisty_db.insert(term, cui, stys, preferred)
+    ss_db = SimstringDBWriter(simstring_dir)
+    for term in terms:
+        ss_db.insert(term)
+    ss_db.close()
 
 
 def install_spacy(lang):
@@ -154,21 +346,59 @@ def parse_args():
         help='Normalize unicode strings to their closest ASCII representation'
     )
     ap.add_argument(
-        '-d', '--database-backend', choices=('leveldb', 'unqlite'), default='unqlite',
-        help='KV database to use to store CUIs and semantic types'
+        '-d', '--database-backend', choices=('leveldb', 'unqlite', 'mmap'),
+        default='unqlite',
+        help=('KV database to use to store CUIs and semantic types; `mmap` '
+              'builds a read-only, memory-mapped index instead')
+    )
+    ap.add_argument(
+        '-F', '--database-format', choices=('compact', 'pickle'),
+        default='compact',
+        help=('How CUIs and semantic types are encoded in the database; '
+              '`compact` is smaller and faster to read, but requires '
+              'CUIs and semantic types to follow the UMLS format '
+              '(e.g., C0000005, T047)')
     )
     ap.add_argument(
         '-E', '--language', default='ENG', choices=LANGUAGES,
         help='Extract concepts of the specified language'
     )
+    ap.add_argument(
+        '-S', '--semtypes', nargs='+', default=None,
+        help=('Only install concepts that belong to at least one of these '
+              'semantic types (e.g., T047 T184); use `default` to select '
+              'the semantic types QuickUMLS accepts by default')
+    )
+    ap.add_argument(
+        '-j', '--jobs', default=multiprocessing.cpu_count(), type=int,
+        help='Number of processes used to parse MRCONSO.RRF'
+    )
+    ap.add_argument(
+        '--skip-spacy-download', action='store_true',
+        help=('Do not check whether the spaCy model for the language is '
+              'installed, nor download it (e.g., for offline installations)')
+    )
+    ap.add_argument(
+        '-R', '--resume', action='store_true',
+        help=('Resume an interrupted installation in destination_path '
+              'instead of starting from an empty directory')
+    )
     opts = ap.parse_args()
+
+    if opts.semtypes == ['default']:
+        opts.semtypes = sorted(ACCEPTED_SEMTYPES)
+
+    if opts.database_backend == 'mmap' and opts.database_format != 'compact':
+        ap.error('the mmap database backend requires the compact format')
+
     return opts
 
 
 def main():
     opts = parse_args()
 
-    install_spacy(opts.language)
+    if not opts.skip_spacy_download:
+        install_spacy(opts.language)
 
     if not os.path.exists(opts.destination_path):
         msg = ('Directory "{}" does not exists; should I create it? [y/N] '
@@ -181,7 +411,14 @@ def main():
             print('Aborting.')
             exit(1)
 
-    if len(os.listdir(opts.destination_path)) > 0:
+    # an installation can only be resumed if it left a checkpoint behind
+    resume = opts.resume and os.path.exists(
+        os.path.join(opts.destination_path, '.checkpoint')
+    )
+
+    if resume:
+        print('Resuming installation in "{}"'.format(opts.destination_path))
+    elif len(os.listdir(opts.destination_path)) > 0:
         msg = ('Directory "{}" is not empty; should I empty it? [y/N] '
                ''.format(opts.destination_path))
         empty = input(msg).lower().strip() == 'y'
@@ -192,6 +429,24 @@ def main():
             print('Aborting.')
             exit(1)
 
+    # options that affect the content of the databases; an installation
+    # can only be resumed with the same ones
+    try:
+        checkpoint = InstallCheckpoint(opts.destination_path, {
+            'umls_installation_path': os.path.abspath(
+                opts.umls_installation_path
+            ),
+            'lowercase': opts.lowercase,
+            'normalize_unicode': opts.normalize_unicode,
+            'database_backend': opts.database_backend,
+            'database_format': opts.database_format,
+            'language': opts.language,
+            'semtypes': opts.semtypes
+        })
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        exit(1)
+
     if opts.normalize_unicode:
         try:
             unidecode
@@ -217,16 +472,50 @@ def main():
     with open(flag_fp, 'w') as f:
         f.write(opts.database_backend)
 
+    flag_fp = os.path.join(opts.destination_path, 'database_format.flag')
+    with open(flag_fp, 'w') as f:
+        if opts.database_format == 'compact':
+            f.write('compact:{}'.format(COMPACT_FORMAT_VERSION))
+        else:
+            f.write(opts.database_format)
+
+    # stopwords are saved with the installation, so that QuickUMLS doesn't
+    # have to load them from nltk every time it starts
+    if LANGUAGES[opts.language] is not None:
+        stopwords_fp = os.path.join(opts.destination_path, STOPWORDS_FILE)
+        with codecs.open(stopwords_fp, 'w', encoding='utf-8') as f:
+            for word in get_stopwords(LANGUAGES[opts.language]):
+                f.write(word + '\n')
+
     mrconso_path = os.path.join(opts.umls_installation_path, 'MRCONSO.RRF')
     mrsty_path = os.path.join(opts.umls_installation_path, 'MRSTY.RRF')
 
-    mrconso_iterator = extract_from_mrconso(mrconso_path, mrsty_path, opts)
-
     simstring_dir = os.path.join(opts.destination_path, 'umls-simstring.db')
     cuisty_dir = os.path.join(opts.destination_path, 'cui-semtypes.db')
 
-    parse_and_encode_ngrams(mrconso_iterator, simstring_dir, cuisty_dir,
-                            database_backend=opts.database_backend)
+    start = time.time()
+
+    with timed_stage('loading semantic types'):
+        sem_types = load_semantic_types(mrsty_path, opts)
+
+    with timed_stage('parsing MRCONSO'):
+        chunk_fps = parse_mrconso(mrconso_path, checkpoint, opts)
+
+    with timed_stage('grouping terms'):
+        terms = group_terms(chunk_fps, sem_types)
+    print('{:,} unique terms'.format(len(terms)))
+
+    if not checkpoint.get('cuisty_done'):
+        with timed_stage('writing CUIs and semantic types'):
+            write_cuisty_db(terms, sem_types, cuisty_dir, checkpoint, opts)
+        checkpoint.set('cuisty_done', True)
+
+    with timed_stage('writing simstring database'):
+        write_simstring_db(terms, simstring_dir)
+
+    checkpoint.clear()
+
+    print('\nCOMPLETED in {:.2f} s'.format(time.time() - start))
 
 
 if __name__ == '__main__':
@@ -1,14 +1,23 @@
 '''Minimal client server through sockets
 https://github.com/lucasoldaini/MinimalServer'''
 
+import os
 import six
 import sys
 import time
 import math
 import socket
+import struct
+import asyncio
+import signal
 import inspect
 import datetime
+import traceback
+import functools
+import contextlib
 import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import SocketServer as socketserver
@@ -18,6 +27,18 @@ except ImportError:
     import pickle
 
 
+# a client using the framed protocol sends this right after connecting;
+# pickled messages of the chunked protocol never start with it.
+FRAMED_PROTOCOL_MAGIC = b'QUMLS/F1'
+
+# every frame is preceded by its length, as an unsigned 64-bit integer
+FRAME_HEADER = struct.Struct('!Q')
+
+# frames are received in a buffer of the size in their header, so larger
+# frames are refused rather than trusting the header of any message
+MAX_FRAME_SIZE = 1 << 30
+
+
 def pad_message(message, blocklength):
     """Pad a message so its length is a multiple of blocklength."""
     message_padded_length = (
@@ -26,9 +47,10 @@ def pad_message(message, blocklength):
     return padded_message
 
 
-def receive_data_in_chunks(sock, buffersize):
-    """Receive data in chunks of size buffersize from the socket"""
-    chunk = sock.recv(buffersize)
+def receive_data_in_chunks(sock, buffersize, prefix=b''):
+    """Receive data in chunks of size buffersize from the socket; prefix
+    is the beginning of the message, if it was already received."""
+    chunk = prefix + sock.recv(buffersize - len(prefix))
     chunks = [chunk]
 
     # keep reading until chunks are available
@@ -49,15 +71,104 @@ def send_data_in_chunks(data, sock, buffersize):
     sock.send(b' ' * buffersize)
 
 
+def receive_exactly(sock, size):
+    """Receive exactly size bytes from the socket; returns fewer bytes
+    only if the connection is closed before size bytes are received."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        cnt = sock.recv_into(view[received:], size - received)
+        if cnt == 0:
+            break
+        received += cnt
+    return bytes(buf[:received])
+
+
+def send_frame(data, sock):
+    """Send data preceded by its length"""
+    # header and data are sent together, so that small messages
+    # fit in a single packet
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def receive_frame(sock, max_size=MAX_FRAME_SIZE):
+    """Receive a message sent with send_frame; returns None if the
+    connection was closed before a new message started. Messages longer
+    than max_size bytes raise a ValueError, and are not received."""
+    header = receive_exactly(sock, FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise RuntimeError('connection closed while receiving a message.')
+
+    size, = FRAME_HEADER.unpack(header)
+    if size > max_size:
+        msg = 'message of {} bytes is larger than the limit ({} bytes).'
+        raise ValueError(msg.format(size, max_size))
+    data = receive_exactly(sock, size)
+    if len(data) < size:
+        raise RuntimeError('connection closed while receiving a message.')
+    return data
+
+
+def call_method(served_object, method_name, args, kwargs):
+    """Execute method_name of served_object; returns either its response
+    or the exception it raised."""
+    try:
+        response = getattr(served_object, method_name)(*args, **kwargs)
+
+        # generators can't be pickled, so we consume them here
+        # and send the results back as a list
+        if inspect.isgenerator(response):
+            response = list(response)
+    except Exception as ex:
+        response = ex
+    return response
+
+
 class MinimalServerHandler(socketserver.BaseRequestHandler):
     """Handle requests to the TCP server"""
 
     def handle(self):
-        """Handle request by executing the specified method from the
-        served object"""
-
-        # receives data
-        data = receive_data_in_chunks(self.request, self.server.buffersize)
+        """Handle requests by executing the specified method from the
+        served object. The protocol is chosen by the client: if it opens
+        the connection with FRAMED_PROTOCOL_MAGIC, requests are framed
+        and the connection is kept open; otherwise, a single request is
+        received in padded chunks."""
+
+        prefix = receive_exactly(self.request, len(FRAMED_PROTOCOL_MAGIC))
+
+        if prefix != FRAMED_PROTOCOL_MAGIC:
+            data = receive_data_in_chunks(
+                self.request, self.server.buffersize, prefix=prefix
+            )
+            # send the response to the client in chunks
+            with self.server.active_request():
+                send_data_in_chunks(
+                    self.execute(data), self.request, self.server.buffersize
+                )
+            return
+
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # serve requests until the client closes the connection
+        while True:
+            try:
+                data = receive_frame(
+                    self.request, self.server.max_frame_size
+                )
+            except (RuntimeError, ValueError):
+                # the rest of a truncated or refused message can't be
+                # told apart from the next one, so the connection is closed
+                break
+            if data is None:
+                break
+            with self.server.active_request():
+                send_frame(self.execute(data), self.request)
+
+    def execute(self, data):
+        """Execute a pickled request, and return the pickled response"""
 
         # parses the target method name, args, and kwargs
         method_name, args, kwargs = pickle.loads(data)
@@ -65,16 +176,11 @@ class MinimalServerHandler(socketserver.BaseRequestHandler):
         # try executing the method from the server object, if it
         # fails, pass the error as response (the client will raise
         # the expection)
-        try:
-            response = getattr(
-                self.server.served_object, method_name)(*args, **kwargs)
-        except Exception as ex:
-            response = ex
+        response = call_method(
+            self.server.served_object, method_name, args, kwargs
+        )
 
-        # send the response to the client in chunks
-        send_data_in_chunks(
-            pickle.dumps(response, protocol=self.server.pickle_protocol),
-            self.request, self.server.buffersize)
+        return pickle.dumps(response, protocol=self.server.pickle_protocol)
 
 
 class MinimalServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
@@ -82,13 +188,36 @@ class MinimalServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     served_object = None
     buffersize = 2048
     pickle_protocol = None
+    max_frame_size = MAX_FRAME_SIZE
+
+    # clients using the framed protocol keep their connections open;
+    # their threads must not prevent the server from stopping.
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        socketserver.TCPServer.__init__(self, *args, **kwargs)
+        self.active_requests = 0
+        self._active_requests_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def active_request(self):
+        """Keep track of requests being executed, so that the server
+        can wait for them before stopping."""
+        with self._active_requests_lock:
+            self.active_requests += 1
+        try:
+            yield
+        finally:
+            with self._active_requests_lock:
+                self.active_requests -= 1
 
 
 class MinimalClient(object):
     """Minimal client to provide communication with the server"""
 
     def __init__(self, target_class, host='localhost', port=4444,
-                 buffersize=2048, pickle_protocol=None):
+                 buffersize=2048, pickle_protocol=None, protocol='chunked',
+                 pool_size=4, pipeline_depth=32):
         """Initialize the client
         Args:
             target_class (object): the class to be served by the
@@ -101,15 +230,38 @@ class MinimalClient(object):
                 used to pickle / unpickle objects. Necessary to be set
                 if and only if server and client are running on different
                 Python versions.
+            protocol (str): either "chunked", which opens a new connection
+                for every request and sends messages padded to buffersize,
+                or "framed", which sends length-prefixed messages over
+                persistent connections. "framed" requires a server that
+                supports the framed protocol (older servers only support
+                "chunked").
+            pool_size (int): maximum number of idle connections kept open
+                with the "framed" protocol.
+            pipeline_depth (int): maximum number of requests sent by
+                `pipeline` before their responses are read.
         """
 
         if pickle_protocol is None:
             pickle_protocol = pickle.HIGHEST_PROTOCOL
 
+        if protocol not in {'chunked', 'framed'}:
+            msg = 'protocol must be "chunked" or "framed", not "{}"'.format(
+                protocol
+            )
+            raise ValueError(msg)
+
         self.host = host
         self.port = port
         self.buffersize = buffersize
         self.pickle_protocol = pickle_protocol
+        self.protocol = protocol
+        self.pool_size = pool_size
+        self.pipeline_depth = pipeline_depth
+
+        # idle connections for the framed protocol
+        self._pool = []
+        self._pool_lock = threading.Lock()
 
         if six.PY2:
             predicate = inspect.ismethod
@@ -123,6 +275,85 @@ class MinimalClient(object):
                 continue
             setattr(self, method_name, self._func_req_wrapper(method_name))
 
+    def _connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((self.host, self.port))
+        if self.protocol == 'framed':
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(FRAMED_PROTOCOL_MAGIC)
+        return sock
+
+    def _acquire_connection(self):
+        """Returns an idle connection and whether it is a new one"""
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop(), False
+        return self._connect(), True
+
+    def _release_connection(self, sock):
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        """Close all idle connections"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for sock in pool:
+            sock.close()
+
+    def _parse_response(self, response):
+        try:
+            # unpickles the response
+            data = pickle.loads(response)
+        except EOFError:
+            # server sent an empty message"
+            msg = 'empty message received from the server.'
+            raise RuntimeError(msg)
+        return data
+
+    def _request_chunked(self, data):
+        # open the socket
+        sock = self._connect()
+
+        # tries sending the data and getting a response back
+        try:
+            send_data_in_chunks(data, sock, self.buffersize)
+            response = receive_data_in_chunks(sock, self.buffersize)
+        finally:
+            sock.close()
+
+        return response
+
+    def _request_framed(self, data):
+        while True:
+            sock, is_new = self._acquire_connection()
+            try:
+                send_frame(data, sock)
+                response = receive_frame(sock)
+            except ValueError:
+                # the response is larger than MAX_FRAME_SIZE
+                sock.close()
+                raise
+            except (socket.error, RuntimeError):
+                sock.close()
+                # the server might have closed an idle connection; a
+                # request that fails on a new connection is not retried
+                if is_new:
+                    raise
+                continue
+
+            if response is None:
+                sock.close()
+                if is_new:
+                    raise RuntimeError('connection closed by the server.')
+                continue
+
+            self._release_connection(sock)
+            return response
+
     def _func_req_wrapper(self, method_name):
         """create a method with the same method_name that communicate
         with the server"""
@@ -134,24 +365,12 @@ class MinimalClient(object):
             data = pickle.dumps((method_name, args, kwargs),
                                 protocol=self.pickle_protocol)
 
-            # open the socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.host, self.port))
+            if self.protocol == 'framed':
+                response = self._request_framed(data)
+            else:
+                response = self._request_chunked(data)
 
-            # tries sending the data and getting a response back
-            try:
-                send_data_in_chunks(data, sock, self.buffersize)
-                response = receive_data_in_chunks(sock, self.buffersize)
-            finally:
-                sock.close()
-
-            try:
-                # unpickles the response
-                data = pickle.loads(response)
-            except EOFError:
-                # server sent an empty message"
-                msg = 'empty message received from the server.'
-                raise RuntimeError(msg)
+            data = self._parse_response(response)
 
             # raises an exception if an exception was raised by the
             # served object while the server was executing method named
@@ -163,6 +382,60 @@ class MinimalClient(object):
 
         return func_request
 
+    def pipeline(self, requests):
+        """Send several requests over one connection without waiting for
+        each response before sending the next; requires the "framed"
+        protocol.
+
+        Args:
+            requests (iterable): (method_name, args, kwargs) tuples.
+
+        Returns:
+            list: the response to each request, in order. If any request
+                raised an exception on the server, the first such exception
+                is raised once all responses have been received.
+        """
+        if self.protocol != 'framed':
+            raise ValueError('pipelining requires the "framed" protocol.')
+
+        sock = self._connect()
+        responses = []
+        in_flight = 0
+
+        try:
+            for method_name, args, kwargs in requests:
+                # responses are read while sending, so that neither side
+                # blocks on a full socket buffer
+                if in_flight >= self.pipeline_depth:
+                    responses.append(receive_frame(sock))
+                    in_flight -= 1
+
+                send_frame(
+                    pickle.dumps((method_name, args, kwargs),
+                                 protocol=self.pickle_protocol),
+                    sock
+                )
+                in_flight += 1
+
+            while in_flight > 0:
+                responses.append(receive_frame(sock))
+                in_flight -= 1
+        except Exception:
+            sock.close()
+            raise
+
+        if any(response is None for response in responses):
+            sock.close()
+            raise RuntimeError('connection closed by the server.')
+
+        self._release_connection(sock)
+
+        results = [self._parse_response(response) for response in responses]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
 
 def run_server(served_object, host='localhost',
                port=4444, buffersize=2048, pickle_protocol=None):
@@ -216,3 +489,421 @@ def run_server(served_object, host='localhost',
     # Terminate the server
     server.shutdown()
     server.server_close()
+
+
+class AsyncMinimalServer(object):
+    """Asyncio server speaking the same protocols as MinimalServer.
+
+    Connections are handled by a single event loop; requests are put in a
+    bounded queue, from which they are taken in micro-batches and executed
+    by a pool of threads. When the queue is full, the server stops reading
+    from clients until requests are completed.
+
+    Requests to a method in batch_methods (with one positional argument)
+    are coalesced: requests in the same micro-batch with the same keyword
+    arguments are answered by a single call to the corresponding batch
+    method, which takes a list of arguments and returns (or yields) one
+    response for each of them.
+    """
+
+    def __init__(self, served_object, buffersize=2048, pickle_protocol=None,
+                 max_queue=1000, max_batch_size=32, batch_timeout=0.005,
+                 n_threads=1, batch_methods=None,
+                 max_frame_size=MAX_FRAME_SIZE):
+        if pickle_protocol is None:
+            pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+        self.served_object = served_object
+        self.buffersize = buffersize
+        self.pickle_protocol = pickle_protocol
+        self.max_queue = max_queue
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.n_threads = n_threads
+        self.batch_methods = batch_methods or {}
+        self.max_frame_size = max_frame_size
+
+    async def serve(self, host=None, port=None, sock=None, grace_period=0):
+        """Serve requests until cancelled, either on host and port or on
+        an already listening socket. Once cancelled, no new connections
+        are accepted, and requests already received are given up to
+        grace_period seconds to complete."""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.pending = 0
+
+        # at most one batch per thread is executed at any time
+        self.slots = asyncio.Semaphore(self.n_threads)
+
+        if sock is None:
+            address = {'host': host, 'port': port, 'reuse_address': True}
+        else:
+            address = {'sock': sock}
+
+        with ThreadPoolExecutor(self.n_threads) as executor:
+            self.executor = executor
+            server = await asyncio.start_server(
+                self.handle_connection, **address
+            )
+            dispatcher = self.loop.create_task(self.dispatch())
+            try:
+                await server.serve_forever()
+            finally:
+                server.close()
+                deadline = self.loop.time() + grace_period
+                while self.pending > 0 and self.loop.time() < deadline:
+                    await asyncio.sleep(0.05)
+                dispatcher.cancel()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            prefix = await reader.readexactly(len(FRAMED_PROTOCOL_MAGIC))
+
+            if prefix != FRAMED_PROTOCOL_MAGIC:
+                # chunked protocol: the message is padded to a multiple of
+                # buffersize, and followed by an empty chunk
+                chunks = [
+                    prefix + await reader.readexactly(
+                        self.buffersize - len(prefix)
+                    )
+                ]
+                while chunks[-1].strip():
+                    chunks.append(await reader.readexactly(self.buffersize))
+
+                response = await self.submit(b''.join(chunks).strip())
+                writer.write(pad_message(response, self.buffersize))
+                writer.write(b' ' * self.buffersize)
+                await writer.drain()
+                return
+
+            sock = writer.get_extra_info('socket')
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError as ex:
+                    # the client closed the connection between requests
+                    if not ex.partial:
+                        break
+                    raise
+
+                size, = FRAME_HEADER.unpack(header)
+                if size > self.max_frame_size:
+                    break
+                response = await self.submit(await reader.readexactly(size))
+                writer.write(FRAME_HEADER.pack(len(response)) + response)
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # idle connections are cancelled when the server stops
+            pass
+        finally:
+            writer.close()
+
+    async def submit(self, data):
+        """Queue a pickled request, and wait for its pickled response"""
+        try:
+            request = pickle.loads(data)
+        except Exception as ex:
+            return pickle.dumps(ex, protocol=self.pickle_protocol)
+
+        self.pending += 1
+        try:
+            future = self.loop.create_future()
+            await self.queue.put((request, future))
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def dispatch(self):
+        """Take requests from the queue in batches, and execute them"""
+        while True:
+            batch = [await self.queue.get()]
+
+            # wait a little for more requests, unless a batch is full
+            deadline = self.loop.time() + self.batch_timeout
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self.queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            await self.slots.acquire()
+            requests, futures = zip(*batch)
+            task = self.loop.run_in_executor(
+                self.executor, self.execute_batch, requests
+            )
+            task.add_done_callback(
+                functools.partial(self._batch_done, futures)
+            )
+
+    def _batch_done(self, futures, task):
+        self.slots.release()
+
+        if task.exception() is not None:
+            responses = [
+                pickle.dumps(task.exception(), protocol=self.pickle_protocol)
+            ] * len(futures)
+        else:
+            responses = task.result()
+
+        for future, response in zip(futures, responses):
+            if not future.cancelled():
+                future.set_result(response)
+
+    def execute_batch(self, requests):
+        """Execute a batch of requests; returns their pickled responses"""
+        responses = [None] * len(requests)
+
+        # requests to batch methods with the same keyword arguments
+        groups = collections.OrderedDict()
+        for i, (method_name, args, kwargs) in enumerate(requests):
+            key = None
+            if method_name in self.batch_methods and len(args) == 1:
+                key = (method_name, tuple(sorted(kwargs.items())))
+                try:
+                    hash(key)
+                except TypeError:
+                    key = None
+
+            if key is None:
+                responses[i] = call_method(
+                    self.served_object, method_name, args, kwargs
+                )
+            else:
+                groups.setdefault(key, []).append(i)
+
+        for (method_name, kwargs), positions in groups.items():
+            batch_response = call_method(
+                self.served_object, self.batch_methods[method_name],
+                ([requests[i][1][0] for i in positions], ), dict(kwargs)
+            )
+
+            if isinstance(batch_response, Exception):
+                # execute requests one by one, so that only the ones
+                # causing the error receive it
+                for i in positions:
+                    responses[i] = call_method(
+                        self.served_object, *requests[i]
+                    )
+            else:
+                for i, response in zip(positions, batch_response):
+                    responses[i] = response
+
+        return [
+            pickle.dumps(response, protocol=self.pickle_protocol)
+            for response in responses
+        ]
+
+
+def run_async_server(served_object, host='localhost', port=4444,
+                     buffersize=2048, pickle_protocol=None, max_queue=1000,
+                     max_batch_size=32, batch_timeout=0.005, n_threads=1,
+                     batch_methods=None):
+    """Runs the asyncio server; see AsyncMinimalServer for the batching
+    options, and run_server for the others.
+    Args:
+        max_queue (int): maximum number of requests waiting to be executed.
+        max_batch_size (int): maximum number of requests in a batch.
+        batch_timeout (float): seconds to wait for more requests before
+            executing a batch that is not full.
+        n_threads (int): number of threads executing batches.
+        batch_methods (dict): maps methods to their batch counterpart.
+    """
+    server = AsyncMinimalServer(
+        served_object, buffersize=buffersize,
+        pickle_protocol=pickle_protocol, max_queue=max_queue,
+        max_batch_size=max_batch_size, batch_timeout=batch_timeout,
+        n_threads=n_threads, batch_methods=batch_methods
+    )
+
+    print(
+        '[{}] async server running at {}:{} (press ^C to interrupt)'.format(
+            datetime.datetime.now().isoformat(), host, port
+        )
+    )
+
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        print(
+            '\n[{}] server stopped'.format(datetime.datetime.now().isoformat())
+        )
+
+
+def _serve_prefork_worker(factory, sock, buffersize, pickle_protocol,
+                          use_async, grace_period, async_options):
+    """Create the served object, and serve requests on sock until
+    SIGTERM is received."""
+    served_object = factory()
+
+    if use_async:
+        server = AsyncMinimalServer(
+            served_object, buffersize=buffersize,
+            pickle_protocol=pickle_protocol, **async_options
+        )
+
+        async def serve():
+            task = asyncio.ensure_future(
+                server.serve(sock=sock, grace_period=grace_period)
+            )
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, task.cancel
+            )
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run(serve())
+        return
+
+    server = MinimalServer(
+        sock.getsockname(), MinimalServerHandler, bind_and_activate=False
+    )
+    server.socket.close()
+    server.socket = sock
+    server.served_object = served_object
+    server.buffersize = buffersize
+    server.pickle_protocol = pickle_protocol
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    while not stop.wait(1):
+        pass
+
+    # stop accepting connections, then wait for running requests
+    server.shutdown()
+    deadline = time.time() + grace_period
+    while server.active_requests > 0 and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def run_prefork_server(factory, n_workers, host='localhost', port=4444,
+                       buffersize=2048, pickle_protocol=None,
+                       use_async=False, grace_period=10, **async_options):
+    """Runs n_workers server processes sharing the same listening socket.
+    Args:
+        factory (callable): returns the object to be served; it is called
+            by each worker after it has been forked, so that every worker
+            has its own copy (and its own database handles).
+        n_workers (int): number of worker processes. Workers that exit
+            unexpectedly are replaced.
+        use_async (bool): whether workers run an asyncio server (see
+            run_async_server, which describes async_options) instead of
+            a threaded one.
+        grace_period (float): seconds workers are given to complete
+            running requests when the server is stopped.
+        host, port, buffersize, pickle_protocol: see run_server.
+    """
+
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('pre-forked workers are not supported on this '
+                           'platform.')
+
+    if pickle_protocol is None:
+        pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+
+    # pid of each worker, and when it was started
+    workers = {}
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                # ^C is handled by the parent, which stops the workers
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                _serve_prefork_worker(
+                    factory, sock, buffersize, pickle_protocol, use_async,
+                    grace_period, async_options
+                )
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        workers[pid] = time.time()
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(n_workers):
+        start_worker()
+
+    print(
+        '[{}] server running at {}:{} with {} workers '
+        '(press ^C to interrupt)'.format(
+            datetime.datetime.now().isoformat(), host, port, n_workers
+        )
+    )
+
+    while not stopping:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+
+        started = workers.pop(pid, None)
+        if started is None:
+            continue
+
+        print(
+            '[{}] worker {} exited with status {}; restarting it'.format(
+                datetime.datetime.now().isoformat(), pid, status
+            ),
+            file=sys.stderr
+        )
+
+        # don't restart workers in a tight loop if they can't start
+        if time.time() - started < 1:
+            time.sleep(1)
+        start_worker()
+
+    print('\n[{}] stopping workers'.format(datetime.datetime.now().isoformat()))
+
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+
+    deadline = time.time() + grace_period + 5
+    while workers and time.time() < deadline:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.1)
+        else:
+            workers.pop(pid, None)
+
+    for pid in workers:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    sock.close()
+    print('[{}] server stopped'.format(datetime.datetime.now().isoformat()))
@@ -0,0 +1,158 @@
+'''Process-parallel matching on top of a single QuickUMLS instance.
+
+Workers are forked from the process that created the matcher: the spaCy
+model is inherited (and shared copy-on-write) rather than loaded again,
+while each worker opens its own read-only handles to the simstring and
+CUI/semantic types databases right after it starts.
+'''
+from __future__ import unicode_literals, division, print_function
+
+# built in modules
+import os
+import itertools
+import collections
+import multiprocessing
+
+# project modules
+from . import toolbox
+
+
+# matcher used by the worker processes; it is set in the parent right
+# before the workers are forked, so it never needs to be pickled.
+_matcher = None
+
+
+def _init_worker():
+    # database handles opened by the parent can't be safely shared
+    # with the children, so every worker opens its own.
+    _matcher._open_databases()
+
+
+def _match_chunk(texts, best_match, ignore_syntax, collect_stats):
+    ngram_count = _matcher._ngram_count
+    stats = toolbox.MatchStats() if collect_stats else None
+    matches = list(_matcher.match_batch(
+        texts, best_match=best_match, ignore_syntax=ignore_syntax,
+        batch_size=len(texts), stats=stats
+    ))
+    return matches, _matcher._ngram_count - ngram_count, stats
+
+
+def _make_chunks(iterable, chunksize):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ParallelQuickUMLS(object):
+    """Pool of worker processes sharing a QuickUMLS matcher."""
+
+    def __init__(self, matcher, n_workers=None):
+        """Start the worker processes
+
+        Args:
+            matcher (QuickUMLS): matcher to be used by the workers; it must
+                have been created as a standalone matcher (i.e., not as a
+                spaCy component).
+            n_workers (int, optional): Number of worker processes. Defaults
+                to the number of CPUs.
+
+        Raises:
+            ValueError: if the matcher has no spaCy pipeline, if its
+                database backend can't be read by more than one process,
+                or if processes can't be forked on this platform.
+        """
+        global _matcher
+
+        if matcher.nlp is None:
+            raise ValueError(
+                'Parallel matching is not available when QuickUMLS is '
+                'used as a spaCy component.'
+            )
+
+        if matcher._database_backend == 'leveldb':
+            raise ValueError(
+                'leveldb databases can only be opened by one process at '
+                'the time; please use an installation created with '
+                '`--database-backend unqlite` or `--database-backend mmap` '
+                'for parallel matching.'
+            )
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError(
+                'Parallel matching requires the "fork" start method, which '
+                'is not available on this platform.'
+            )
+
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        # ngrams looked up by the workers (see QuickUMLS.get_stats)
+        self.ngram_count = 0
+
+        _matcher = matcher
+        context = multiprocessing.get_context('fork')
+        self.pool = context.Pool(self.n_workers, initializer=_init_worker)
+
+    def match(self, texts, best_match=True, ignore_syntax=False,
+              chunksize=64, max_pending=None, stats=None):
+        """Perform UMLS concept resolution for a sequence of strings.
+
+            Texts are grouped in chunks of `chunksize` and distributed to
+            the workers; at most `max_pending` chunks are in flight at any
+            time, so `texts` is consumed at the pace matches are produced.
+
+        Args:
+            texts (Iterable[str]): Texts on which to run the algorithm.
+            best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
+            ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). Defaults to False.
+            chunksize (int, optional): Number of texts sent to a worker
+                at once. Defaults to 64.
+            max_pending (int, optional): Maximum number of chunks queued
+                or being processed at any time. Defaults to twice the
+                number of workers.
+            stats (toolbox.MatchStats, optional): If provided, timings and
+                counters collected by the workers are added to it.
+
+        Yields:
+            List: List of all matches for each text, in the same order
+                as the input texts.
+        """
+        if max_pending is None:
+            max_pending = 2 * self.n_workers
+
+        pending = collections.deque()
+
+        for chunk in _make_chunks(texts, chunksize):
+            if len(pending) >= max_pending:
+                for matches in self._get_results(pending.popleft(), stats):
+                    yield matches
+
+            pending.append(self.pool.apply_async(
+                _match_chunk,
+                (chunk, best_match, ignore_syntax, stats is not None)
+            ))
+
+        while pending:
+            for matches in self._get_results(pending.popleft(), stats):
+                yield matches
+
+    def _get_results(self, async_result, stats):
+        chunk_matches, ngram_count, chunk_stats = async_result.get()
+        self.ngram_count += ngram_count
+        if stats is not None:
+            stats.merge(chunk_stats)
+        return chunk_matches
+
+    def close(self):
+        """Stop the worker processes"""
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
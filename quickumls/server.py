@@ -1,11 +1,24 @@
+import os
+import functools
 from argparse import ArgumentParser
 
 from .core import QuickUMLS
-from .network import run_server
+from .constants import SPACY_UNUSED_COMPONENTS
+from .network import run_server, run_async_server, run_prefork_server
+
+
+def get_database_backend(quickumls_fp):
+    # installations without a flag use leveldb (see QuickUMLS)
+    database_backend_fp = os.path.join(quickumls_fp, 'database_backend.flag')
+    if not os.path.exists(database_backend_fp):
+        return 'leveldb'
+    with open(database_backend_fp) as f:
+        return f.read().strip()
 
 
 def run_quickumls_server(opts):
-    matcher = QuickUMLS(
+    make_matcher = functools.partial(
+        QuickUMLS,
         quickumls_fp=opts.quickumls_fp,
         threshold=opts.threshold,
         overlapping_criteria=opts.overlapping_criteria,
@@ -13,10 +26,39 @@ def run_quickumls_server(opts):
         window=opts.window,
         min_match_length=opts.min_match_length,
         verbose=opts.verbose,
-        keep_uppercase=opts.keep_uppercase
+        keep_uppercase=opts.keep_uppercase,
+        ngram_cache_size=opts.ngram_cache_size,
+        result_format=opts.result_format,
+        spacy_exclude=opts.spacy_exclude,
+        document_cache_size=opts.document_cache_size,
+        document_cache_fp=opts.document_cache_fp,
+        max_candidates=opts.max_candidates
     )
 
-    run_server(matcher, host=opts.host, port=opts.port, buffersize=4096)
+    # match requests received together are answered by match_batch
+    async_options = {
+        'max_queue': opts.max_queue,
+        'max_batch_size': opts.max_batch_size,
+        'batch_timeout': opts.batch_timeout / 1000,
+        'n_threads': opts.threads,
+        'batch_methods': {'match': 'match_batch'}
+    }
+
+    if opts.workers > 1:
+        # each worker creates its own matcher after being forked
+        run_prefork_server(
+            make_matcher, opts.workers, host=opts.host, port=opts.port,
+            buffersize=4096, use_async=opts.use_async, **async_options
+        )
+    elif opts.use_async:
+        run_async_server(
+            make_matcher(), host=opts.host, port=opts.port, buffersize=4096,
+            **async_options
+        )
+    else:
+        run_server(
+            make_matcher(), host=opts.host, port=opts.port, buffersize=4096
+        )
 
 
 def parse_args():
@@ -79,7 +121,79 @@ def parse_args():
              'useful for distinguishing acronyms from normal words. For this '
              'the database should be installed without the -L option.'
     )
-    return ap.parse_args()
+    ap.add_argument(
+        '-c', '--ngram-cache-size', default=50000, type=int,
+        help='number of ngrams whose candidate concepts are cached '
+             '(0 to disable caching)'
+    )
+    ap.add_argument(
+        '-r', '--result-format', default='dict', choices=['dict', 'object'],
+        help='return matches as dictionaries or as MatchCandidate objects'
+    )
+    ap.add_argument(
+        '--max-candidates', default=None, type=int,
+        help='maximum number of similar terms whose concepts are looked up '
+             'for each ngram (default: no limit)'
+    )
+    ap.add_argument(
+        '-D', '--document-cache-size', default=0, type=int,
+        help='number of documents whose matches are cached in memory, so '
+             'that repeated documents are answered without matching them '
+             'again (0 to disable caching)'
+    )
+    ap.add_argument(
+        '--document-cache-fp', default=None,
+        help='SQLite file where matches of documents are also cached; it '
+             'persists across restarts, and is shared by all workers'
+    )
+    ap.add_argument(
+        '--spacy-exclude', nargs='*', default=SPACY_UNUSED_COMPONENTS,
+        help='components of the spaCy pipeline that are not loaded '
+             '(default: {}, which QuickUMLS does not use)'.format(
+                 ' '.join(SPACY_UNUSED_COMPONENTS))
+    )
+    ap.add_argument(
+        '-W', '--workers', default=1, type=int,
+        help='number of server processes sharing the same port, each with '
+             'its own matcher; requires an installation that does not use '
+             'leveldb'
+    )
+    ap.add_argument(
+        '-a', '--async', dest='use_async', action='store_true',
+        help='use an asyncio server, which batches match requests '
+             'received together'
+    )
+    ap.add_argument(
+        '--max-queue', default=1000, type=int,
+        help='(async server) maximum number of requests waiting to be '
+             'processed; clients are not read from while the queue is full'
+    )
+    ap.add_argument(
+        '--max-batch-size', default=32, type=int,
+        help='(async server) maximum number of requests processed together'
+    )
+    ap.add_argument(
+        '--batch-timeout', default=5, type=float,
+        help='(async server) milliseconds to wait for more requests before '
+             'processing a batch that is not full'
+    )
+    ap.add_argument(
+        '--threads', default=1, type=int,
+        help='(async server) number of threads processing batches'
+    )
+    opts = ap.parse_args()
+
+    if (
+        opts.workers > 1 and
+        get_database_backend(opts.quickumls_fp) == 'leveldb'
+    ):
+        ap.error(
+            'leveldb databases can only be opened by one process at the '
+            'time; --workers requires an installation created with '
+            '`--database-backend unqlite` or `--database-backend mmap`.'
+        )
+
+    return opts
 
 
 def main():
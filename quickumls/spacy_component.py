@@ -1,67 +1,165 @@
 import spacy
 from spacy.tokens import Span
-from spacy.strings import StringStore
+from spacy.language import Language
+from spacy.util import filter_spans
 
 from .core import QuickUMLS
 from . import constants
 
+
+def get_semtypes(span):
+    # semantic types are stored as a sorted list, which (unlike a set) can
+    # be serialized with the doc, e.g. by DocBin or by nlp.pipe with
+    # n_process > 1; they are returned as a set, as they always have been
+    semtypes = span._.quickumls_semtypes
+    return -1.0 if semtypes is None else set(semtypes)
+
+
+def set_semtypes(span, semtypes):
+    span._.quickumls_semtypes = sorted(semtypes)
+
+
 class SpacyQuickUMLS(object):
     name = 'QuickUMLS matcher'
-    
-    def __init__(self, nlp, quickumls_fp, best_match=True, ignore_syntax=False, **kwargs):
+
+    def __init__(self, nlp, quickumls_fp, best_match=True, ignore_syntax=False, span_group=None, **kwargs):
         """Instantiate SpacyQuickUMLS object
 
-            This creates a QuickUMLS spaCy component which can be used in modular pipelines.  
+            This creates a QuickUMLS spaCy component which can be used in modular pipelines.
             This module adds entity Spans to the document where the entity label is the UMLS CUI and the Span's "underscore" object is extended to contains "similarity" and "semtypes" for matched concepts.
 
+            Entities can't overlap, so only the best concept of each ngram is added to `doc.ents`, and
+            overlapping spans (including entities already in the document) are resolved by
+            `spacy.util.filter_spans`, which keeps the longest ones. To keep all matches instead, store
+            them in a span group (e.g., constants.MEDSPACY_DEFAULT_SPAN_GROUP_NAME), which allows overlaps.
+
         Args:
             nlp: Existing spaCy pipeline.  This is needed to update the vocabulary with UMLS CUI values
             quickumls_fp (str): Path to QuickUMLS data
             best_match (bool, optional): Whether to return only the top match or all overlapping candidates. Defaults to True.
             ignore_syntax (bool, optional): Wether to use the heuristcs introduced in the paper (Soldaini and Goharian, 2016). TODO: clarify,. Defaults to False
+            span_group (str, optional): Name of the span group (`doc.spans`) matches are added to, instead of `doc.ents`. Defaults to None.
             **kwargs: QuickUMLS keyword arguments (see QuickUMLS in core.py)
         """
-        
-        self.quickumls = QuickUMLS(quickumls_fp, 
+
+        # matches never leave the component, so the lighter result
+        # objects are used unless a format is explicitly requested
+        kwargs.setdefault('result_format', 'object')
+
+        self.quickumls = QuickUMLS(quickumls_fp,
             # By default, the QuickUMLS objects creates its own internal spacy pipeline but this is not needed
             # when we're using it as a component in a pipeline
             spacy_component = True,
             **kwargs)
-        
+
         # save this off so that we can get vocab values of labels later
         self.nlp = nlp
-        
+
         # keep these for matching
         self.best_match = best_match
         self.ignore_syntax = ignore_syntax
+        self.span_group = span_group
+
+        # let's extend this with some proprties that we want; extensions
+        # are global, so they might have been set by another instance
+        if not Span.has_extension('similarity'):
+            Span.set_extension('similarity', default = -1.0)
+        if not Span.has_extension('quickumls_semtypes'):
+            Span.set_extension('quickumls_semtypes', default = None)
+        if not Span.has_extension('semtypes'):
+            Span.set_extension('semtypes', getter = get_semtypes, setter = set_semtypes)
+        elif Span.get_extension('semtypes')[2] is not get_semtypes:
+            raise ValueError(
+                'Span extension "semtypes" is already registered with a '
+                'different getter; QuickUMLS needs it to be computed by '
+                'quickumls.spacy_component.get_semtypes. Remove it with '
+                'Span.remove_extension("semtypes") before adding the component.'
+            )
+
+    def _make_spans(self, doc, matches):
+        """Converts QuickUMLS matches into Spans of doc"""
+        spans = []
+
+        for match in matches:
+            # each match may match multiple ngrams; entities can't
+            # overlap, so only the best one is kept for them
+            if self.span_group is None:
+                match = match[:1]
+
+            for ngram_match in match:
+                # char_span() creates a Span from these character indices
+                # UMLS CUI should work well as the label here (it's added
+                # to the vocab by char_span)
+                span = doc.char_span(
+                    ngram_match['start'], ngram_match['end'],
+                    label=ngram_match['cui']
+                )
+
+                # spans that don't align with tokens can't be added
+                if span is None:
+                    continue
+
+                # add some custom metadata to the spans (see get_semtypes)
+                span._.similarity = ngram_match['similarity']
+                span._.quickumls_semtypes = sorted(ngram_match['semtypes'])
+                spans.append(span)
+
+        return spans
+
+    def _add_spans(self, doc, spans):
+        # spans are added all at once, rather than one at the time,
+        # since every assignment copies and validates all of them
+        if self.span_group is not None:
+            if self.span_group in doc.spans:
+                doc.spans[self.span_group].extend(spans)
+            else:
+                doc.spans[self.span_group] = spans
+        else:
+            doc.ents = filter_spans(list(doc.ents) + spans)
 
-        # let's extend this with some proprties that we want
-        Span.set_extension('similarity', default = -1.0)
-        Span.set_extension('semtypes', default = -1.0)
-        
     def __call__(self, doc):
         # pass in the document which has been parsed to this point in the pipeline for ngrams and matches
         matches = self.quickumls._match(doc, best_match=self.best_match, ignore_syntax=self.ignore_syntax)
-        
-        # Convert QuickUMLS match objects into Spans
-        for match in matches:
-            # each match may match multiple ngrams
-            for ngram_match_dict in match:
-                start_char_idx = int(ngram_match_dict['start'])
-                end_char_idx = int(ngram_match_dict['end'])
-                
-                cui = ngram_match_dict['cui']
-                # add the string to the spacy vocab
-                self.nlp.vocab.strings.add(cui)
-                # pull out the value
-                cui_label_value = self.nlp.vocab.strings[cui]
-                
-                # char_span() creates a Span from these character indices
-                # UMLS CUI should work well as the label here
-                span = doc.char_span(start_char_idx, end_char_idx, label = cui_label_value)
-                # add some custom metadata to the spans
-                span._.similarity = ngram_match_dict['similarity']
-                span._.semtypes = ngram_match_dict['semtypes']
-                doc.ents = list(doc.ents) + [span]
-                
-        return doc
\ No newline at end of file
+        self._add_spans(doc, self._make_spans(doc, matches))
+        return doc
+
+    def pipe(self, docs, batch_size=128):
+        """Process a stream of documents, as `nlp.pipe` does.
+
+            Documents are matched one at the time, as by `__call__`; the
+            ngram cache of the matcher is shared by all of them.
+
+        Args:
+            docs (Iterable[Doc]): Documents processed by the previous components of the pipeline.
+            batch_size (int, optional): Ignored; accepted for compatibility with `nlp.pipe`. Defaults to 128.
+
+        Yields:
+            Doc: The documents, with matches added.
+        """
+        for doc in docs:
+            yield self(doc)
+
+
+@Language.factory(
+    'quickumls',
+    default_config={
+        'best_match': True,
+        'ignore_syntax': False,
+        'span_group': None,
+        'quickumls_options': {}
+    },
+    assigns=[
+        'doc.ents', 'doc.spans', 'span._.similarity',
+        'span._.quickumls_semtypes'
+    ]
+)
+def create_quickumls_component(
+        nlp, name, quickumls_fp, best_match, ignore_syntax, span_group,
+        quickumls_options):
+    """Factory that lets `nlp.add_pipe('quickumls', config={...})` create
+    a SpacyQuickUMLS component; quickumls_options are passed to QuickUMLS."""
+    return SpacyQuickUMLS(
+        nlp, quickumls_fp, best_match=best_match,
+        ignore_syntax=ignore_syntax, span_group=span_group,
+        **quickumls_options
+    )
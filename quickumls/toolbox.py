@@ -3,15 +3,26 @@ from __future__ import unicode_literals, division, print_function
 # build-in modules
 import re
 import os
+import math
+import sys
+import json
+import mmap
+import bisect
+from array import array
 from functools import wraps
 import six
+import struct
+import sqlite3
+import hashlib
+import threading
 import unicodedata
+import contextlib
+import collections
 from string import punctuation
 from itertools import takewhile, repeat
 from six.moves import xrange
 
 # installed modules
-import numpy
 import leveldb
 try:
     import unqlite
@@ -89,7 +100,7 @@ def get_similarity(x, y, n, similarity_name):
     elif similarity_name == 'jaccard':
         return intersec / (len(X) + len(Y) - intersec)
     elif similarity_name == 'cosine':
-        return intersec / numpy.sqrt(len(X) * len(Y))
+        return intersec / math.sqrt(len(X) * len(Y))
     elif similarity_name == 'overlap':
         return intersec
     else:
@@ -97,6 +108,43 @@ def get_similarity(x, y, n, similarity_name):
         raise TypeError(msg)
 
 
+def get_similarities(x, ys, n, similarity_name):
+    """Compute get_similarity between x and each string in ys; the ngrams
+    of x are only extracted once, rather than once per string in ys."""
+    if len(x) == 0:
+        return [0.] * len(ys)
+
+    X = set(make_ngrams(x, n))
+    len_x = len(X)
+
+    if similarity_name == 'dice':
+        def score(intersec, len_y):
+            return 2 * intersec / (len_x + len_y)
+    elif similarity_name == 'jaccard':
+        def score(intersec, len_y):
+            return intersec / (len_x + len_y - intersec)
+    elif similarity_name == 'cosine':
+        def score(intersec, len_y):
+            return intersec / math.sqrt(len_x * len_y)
+    elif similarity_name == 'overlap':
+        def score(intersec, len_y):
+            return intersec
+    else:
+        msg = 'Similarity {} not recognized'.format(similarity_name)
+        raise TypeError(msg)
+
+    similarities = []
+    for y in ys:
+        if len(y) == 0:
+            similarities.append(0.)
+            continue
+
+        Y = set(make_ngrams(y, n))
+        similarities.append(score(len(X.intersection(Y)), len(Y)))
+
+    return similarities
+
+
 class SimpleTokenizer(object):
     def __init__(self, stopwords=None, min_length=1, split_sym=None):
         if stopwords == 'default':
@@ -142,6 +190,114 @@ def db_key_encode(term):
         return term.encode('utf-8')
 
 
+# version of the compact encoding used by CuiSemTypesDB; it is written
+# to the database_format.flag file of new installations.
+COMPACT_FORMAT_VERSION = 1
+
+RE_CUI = re.compile(r'^C(\d{7})$')
+RE_SEMTYPE = re.compile(r'^T(\d{3})$')
+
+# flag used to mark preferred terms in compact CUI records
+PREFERRED_BIT = 1 << 31
+
+# size of the fixed-width semantic types bitmasks in the mmap index;
+# enough for semantic types up to T255.
+SEMTYPE_MASK_BYTES = 32
+
+
+def cui_to_int(cui):
+    match = RE_CUI.match(cui)
+    if match is None:
+        msg = (
+            'CUI "{}" can\'t be stored in the compact database format; '
+            'please install QuickUMLS with `--database-format pickle`'
+        ).format(cui)
+        raise ValueError(msg)
+    return int(match.group(1))
+
+
+def int_to_cui(value):
+    return 'C{:07d}'.format(value)
+
+
+def encode_cuis(cuis):
+    """Encode (cui id, is_preferred) pairs, where cui id is the integer
+    form of a CUI (see cui_to_int), as little-endian unsigned 32-bit
+    integers with the preferred flag stored in the most significant bit."""
+    values = [
+        cui_id | (PREFERRED_BIT if is_preferred else 0)
+        for cui_id, is_preferred in cuis
+    ]
+    return struct.pack('<{}I'.format(len(values)), *values)
+
+
+def decode_cuis(data):
+    """Decode a record created by encode_cuis into (cui id, is_preferred)
+    pairs."""
+    values = struct.unpack('<{}I'.format(len(data) // 4), data)
+    return [
+        (value & ~PREFERRED_BIT, 1 if value & PREFERRED_BIT else 0)
+        for value in values
+    ]
+
+
+def encode_cui_key(cui_id):
+    return struct.pack('<I', cui_id)
+
+
+def semtypes_to_mask(semtypes, ignore_invalid=False):
+    """Encode a set of semantic types as a bitmask, where bit i is set
+    if semantic type "T{i:03d}" is present. Semantic types that don't
+    follow this format raise a ValueError, unless ignore_invalid is set."""
+    mask = 0
+    for semtype in semtypes:
+        match = RE_SEMTYPE.match(semtype)
+        if match is not None:
+            mask |= 1 << int(match.group(1))
+        elif not ignore_invalid:
+            msg = (
+                'Semantic type "{}" can\'t be stored in the compact database '
+                'format; please install QuickUMLS with '
+                '`--database-format pickle`'
+            ).format(semtype)
+            raise ValueError(msg)
+    return mask
+
+
+def encode_semtypes(semtypes):
+    mask = semtypes_to_mask(semtypes)
+    return mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+
+def decode_semtypes(data):
+    mask = int.from_bytes(data, 'little')
+    semtypes = set()
+    i = 0
+    while mask:
+        if mask & 1:
+            semtypes.add('T{:03d}'.format(i))
+        mask >>= 1
+        i += 1
+    return semtypes
+
+
+# name of the file where installations keep the stopwords of their language
+STOPWORDS_FILE = 'stopwords.txt'
+
+
+def get_stopwords(language):
+    """Stopwords for a language, as named by nltk (e.g., "english");
+    they are downloaded if necessary."""
+    # nltk is slow to import, so it is only loaded when needed
+    import nltk
+
+    try:
+        return nltk.corpus.stopwords.words(language)
+    except LookupError:
+        nltk.download('stopwords')
+        return nltk.corpus.stopwords.words(language)
+
+
 def countlines(fn):
     """Count lines in fn. Slightly modified version of
     http://stackoverflow.com/a/27518377"""
@@ -152,6 +308,44 @@ def countlines(fn):
     return ln
 
 
+# terms are indexed by simstring as character trigrams
+SIMSTRING_NGRAM_LENGTH = 3
+
+# file, in the simstring database directory, with the sizes of all terms
+SIMSTRING_SIZES_FILE = 'umls-terms.sizes.json'
+
+
+def simstring_size(term):
+    """Number of features of term in the simstring database; terms
+    shorter than a trigram are a single feature."""
+    return max(len(term) - SIMSTRING_NGRAM_LENGTH + 1, 1)
+
+
+def simstring_size_bounds(size, similarity_name, threshold):
+    """Minimum and maximum size of the terms whose similarity with a
+    query of the given size can reach threshold, for the measures where
+    they agree with the terms simstring retrieves (jaccard and cosine);
+    other measures are not bounded."""
+    # simstring retrieves dice candidates outside of the theoretical size
+    # bounds when the query repeats trigrams (e.g., "pain pain" retrieves
+    # "pain"), so sizes can't be used to skip dice queries.
+    if threshold <= 0 or similarity_name in {'dice', 'overlap'}:
+        return 1, float('inf')
+
+    if similarity_name == 'jaccard':
+        min_size, max_size = threshold * size, size / threshold
+    elif similarity_name == 'cosine':
+        min_size = threshold * threshold * size
+        max_size = size / (threshold * threshold)
+    else:
+        msg = 'Similarity {} not recognized'.format(similarity_name)
+        raise TypeError(msg)
+
+    # bounds are slightly widened, so that rounding errors never exclude
+    # a size simstring would consider
+    return math.ceil(min_size - 1e-6), math.floor(max_size + 1e-6)
+
+
 class SimstringDBWriter(object):
     def __init__(self, path):
 
@@ -170,12 +364,22 @@ class SimstringDBWriter(object):
             prepare_string_for_db_input(
                 os.path.join(path, 'umls-terms.simstring')
             ),
-            3, False, True
+            SIMSTRING_NGRAM_LENGTH, False, True
         )
+        self.path = path
+        self.sizes = set()
 
     def insert(self, term):
-        term = prepare_string_for_db_input(safe_unicode(term))
-        self.db.insert(term)
+        term = safe_unicode(term)
+        self.sizes.add(simstring_size(term))
+        self.db.insert(prepare_string_for_db_input(term))
+
+    def close(self):
+        self.db.close()
+
+        # sizes let readers skip queries no term can match
+        with open(os.path.join(self.path, SIMSTRING_SIZES_FILE), 'w') as f:
+            json.dump(sorted(self.sizes), f)
 
 
 class SimstringDBReader(object):
@@ -193,15 +397,53 @@ class SimstringDBReader(object):
         )
         self.db.measure = getattr(simstring, similarity_name)
         self.db.threshold = threshold
+        self.similarity_name = similarity_name
+        self.threshold = threshold
 
-    def get(self, term):
-        term = prepare_string_for_db_input(safe_unicode(term))
-        return self.db.retrieve(term)
+        # databases written by earlier versions don't have sizes
+        sizes_fp = os.path.join(path, SIMSTRING_SIZES_FILE)
+        if os.path.exists(sizes_fp):
+            with open(sizes_fp) as f:
+                self.sizes = json.load(f)
+        else:
+            self.sizes = None
+
+    def can_match(self, term):
+        """False if no term in the database can be similar enough to term
+        (which must have gone through safe_unicode), based on their size;
+        True if they might be, or if sizes are not available."""
+        if self.sizes is None:
+            return True
+
+        min_size, max_size = simstring_size_bounds(
+            simstring_size(term), self.similarity_name, self.threshold
+        )
+        i = bisect.bisect_left(self.sizes, min_size)
+        return i < len(self.sizes) and self.sizes[i] <= max_size
+
+    def get(self, term, normalized=False):
+        """Returns the terms similar to term; if normalized is True, term
+        is assumed to have already gone through safe_unicode."""
+        if not normalized:
+            term = safe_unicode(term)
+        return self.db.retrieve(prepare_string_for_db_input(term))
 
 
 class Intervals(object):
+    """Set of half-open intervals supporting overlap checks.
+
+    As long as the intervals it holds don't overlap with each other (which
+    is always the case when an interval is only appended if it's not
+    already `in` the set), they are kept sorted, and checking whether an
+    interval overlaps with any of them is logarithmic in their number.
+    Appending an overlapping interval falls back to a linear scan.
+    """
+
     def __init__(self):
         self.intervals = []
+        self._starts = []
+        self._ends = []
+        self._disjoint = True
 
     def _is_overlapping_intervals(self, a, b):
         if b[0] < a[1] and b[1] > a[0]:
@@ -212,22 +454,537 @@ class Intervals(object):
             return False
 
     def __contains__(self, interval):
-        return any(
-            self._is_overlapping_intervals(interval, other)
-            for other in self.intervals
-        )
+        if not self._disjoint:
+            return any(
+                self._is_overlapping_intervals(interval, other)
+                for other in self.intervals
+            )
+
+        # intervals are disjoint, so both starts and ends are sorted: the
+        # first interval ending after this one starts is the only one
+        # that could overlap with it.
+        i = bisect.bisect_right(self._ends, interval[0])
+        return i < len(self._starts) and self._starts[i] < interval[1]
+
+    def __len__(self):
+        return len(self.intervals)
 
     def append(self, interval):
-        self.intervals.append(interval)
+        interval = tuple(interval)
+
+        if self._disjoint and interval in self:
+            self._disjoint = False
+
+        i = bisect.bisect_right(self.intervals, interval)
+        self.intervals.insert(i, interval)
+        self._starts.insert(i, interval[0])
+        self._ends.insert(i, interval[1])
+
+
+class MatchCandidate(object):
+    """A concept matched to an ngram, with the same fields as the
+    dictionaries returned by QuickUMLS.match. It uses less memory than a
+    dictionary, and fields can be read both as attributes (match.cui)
+    and as keys (match['cui'])."""
+
+    __slots__ = (
+        'start', 'end', 'ngram', 'term', 'cui', 'similarity', 'semtypes',
+        'preferred'
+    )
+
+    def __init__(
+            self, start, end, ngram, term, cui, similarity, semtypes,
+            preferred):
+        self.start = start
+        self.end = end
+        self.ngram = ngram
+        self.term = term
+        self.cui = cui
+        self.similarity = similarity
+        self.semtypes = semtypes
+        self.preferred = preferred
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, MatchCandidate):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join(
+                '{}={!r}'.format(field, getattr(self, field))
+                for field in self.__slots__
+            )
+        )
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def to_dict(self):
+        d = {field: getattr(self, field) for field in self.__slots__}
+        d['semtypes'] = set(self.semtypes)
+        return d
+
+
+def to_dicts(matches):
+    """Convert the output of QuickUMLS.match (a list of lists of
+    MatchCandidate) to the dictionary format; dictionaries are copied
+    as they are."""
+    return [
+        [
+            candidate.to_dict() if isinstance(candidate, MatchCandidate)
+            else dict(candidate)
+            for candidate in ngram_matches
+        ]
+        for ngram_matches in matches
+    ]
+
+
+class MatchStats(object):
+    """Timings and counters collected while matching; pass an instance
+    to QuickUMLS.match or QuickUMLS.match_batch to fill it. The same
+    instance can be used for several calls, in which case values are
+    accumulated."""
+
+    # seconds spent in each stage of matching
+    STAGES = (
+        'tokenization', 'ngrams', 'simstring', 'scoring', 'cui_lookup',
+        'selection'
+    )
+
+    COUNTERS = (
+        'documents', 'tokens', 'ngrams', 'ngram_cache_hits',
+        'candidates_retrieved', 'rejected_by_similarity',
+        'rejected_by_semtype', 'concepts', 'matches',
+        'document_cache_hits', 'queries_skipped', 'candidates_capped'
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timings = dict.fromkeys(self.STAGES, 0.)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] += seconds
+
+    def incr(self, counter, value=1):
+        self.counters[counter] += value
+
+    def merge(self, other):
+        for stage, seconds in other.timings.items():
+            self.timings[stage] += seconds
+        for counter, value in other.counters.items():
+            self.counters[counter] += value
+
+    def to_dict(self):
+        return {'timings': dict(self.timings), 'counters': dict(self.counters)}
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.to_dict())
+
+
+class LRUCache(object):
+    """Dictionary-like cache that holds at most `maxsize` entries,
+    discarding the least recently used ones first. It can be shared by
+    several threads (e.g., those of network.MinimalServer)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        # locks can't be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class DocumentCache(object):
+    """Cache of the matches of whole documents, keyed by a hash of their
+    text and of the matcher options. Matches are kept pickled in an
+    LRUCache and, if `path` is given, in a SQLite database, so that they
+    persist across runs and can be shared by several processes."""
+
+    def __init__(self, maxsize, path=None):
+        self.path = path
+        self.disk_hits = 0
+        self._memory = LRUCache(maxsize)
+        self._local = threading.local()
+
+    @staticmethod
+    def make_key(text, options):
+        """Key for `text` matched with `options`, a JSON-serializable
+        description of everything that affects the matches."""
+        digest = hashlib.sha256(text.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(options.encode('utf-8'))
+        return digest.hexdigest()
+
+    @property
+    def connection(self):
+        # connections can't be shared between threads (e.g., those of
+        # network.MinimalServer) nor between processes, so each thread
+        # opens its own, and opens it again after a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS matches '
+                '(key TEXT PRIMARY KEY, value BLOB)'
+            )
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        value = self._memory.get(key)
+
+        if value is None and self.path is not None:
+            row = self.connection.execute(
+                'SELECT value FROM matches WHERE key = ?', (key, )
+            ).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                value = bytes(row[0])
+                self._memory.put(key, value)
+
+        # each hit returns a new copy, so callers can modify it
+        return pickle.loads(value) if value is not None else None
+
+    def put(self, key, matches):
+        value = pickle.dumps(matches, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory.put(key, value)
+
+        if self.path is not None:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO matches VALUES (?, ?)',
+                    (key, value)
+                )
+
+    def stats(self):
+        stats = self._memory.stats()
+        # documents found on disk are misses of the in-memory cache
+        stats['hits'] += self.disk_hits
+        stats['misses'] -= self.disk_hits
+        stats['disk_hits'] = self.disk_hits
+        return stats
+
+    def close(self):
+        """Close the connection of the calling thread; connections of
+        other threads are closed when they exit."""
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.connection.close()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memory'] = LRUCache(self._memory.maxsize)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+
+class _IndexTerms(object):
+    """Sequence view of the sorted terms in a CuiSemTypesIndex,
+    so that they can be searched with bisect."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class CuiSemTypesIndex(object):
+    """Read-only, memory-mapped index from terms to CUIs and semantic types.
+
+    A new index is built in memory through `insert` and written to disk
+    by `close`; an existing index file is memory-mapped and can only be
+    read, so any number of processes can share a single copy of it in
+    the page cache. Integers are little-endian and each section starts
+    at a multiple of 8 bytes:
+
+        header           magic, version, number of terms and CUIs, and
+                         the offset of each of the following sections
+        term offsets     uint64[n_terms + 1], offsets in the term blob
+        term blob        utf-8 encoded terms, sorted
+        posting offsets  uint64[n_terms + 1], offsets in the postings
+        postings         uint32[], CUI position | PREFERRED_BIT
+        cui ids          uint32[n_cuis], integer form of each CUI
+        semtype masks    SEMTYPE_MASK_BYTES per CUI
+    """
+    MAGIC = b'QUMLSIDX'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIII4x6Q')
+
+    def __init__(self, path):
+        self.path = path
+
+        # concepts skipped by `get` because of their semantic types
+        self.semtypes_rejected = 0
+
+        if sys.byteorder != 'little':
+            raise OSError(
+                'The mmap database backend is only supported on '
+                'little-endian platforms.'
+            )
+
+        if os.path.exists(path):
+            self._open()
+        else:
+            self._mmap = None
+            self._new_terms = {}
+            self._new_semtypes = {}
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic, version, n_terms, n_cuis, *sections
+        ) = self.HEADER.unpack_from(self._mmap, 0)
+
+        if magic != self.MAGIC or version != self.VERSION:
+            raise IOError(
+                '"{}" is not a valid QuickUMLS index (v.{})'
+                ''.format(self.path, self.VERSION)
+            )
+
+        view = memoryview(self._mmap)
+        (
+            term_offsets_start, blob_start, posting_offsets_start,
+            postings_start, cui_ids_start, masks_start
+        ) = sections
+
+        term_offsets = view[
+            term_offsets_start:term_offsets_start + 8 * (n_terms + 1)
+        ].cast('Q')
+        self._terms = _IndexTerms(
+            term_offsets,
+            view[blob_start:blob_start + term_offsets[n_terms]]
+        )
+
+        self._posting_offsets = view[
+            posting_offsets_start:posting_offsets_start + 8 * (n_terms + 1)
+        ].cast('Q')
+        n_postings = self._posting_offsets[n_terms]
+        self._postings = view[
+            postings_start:postings_start + 4 * n_postings
+        ].cast('I')
+
+        self._cui_ids = view[cui_ids_start:cui_ids_start + 4 * n_cuis].cast('I')
+        self._masks = view[
+            masks_start:masks_start + SEMTYPE_MASK_BYTES * n_cuis
+        ]
+
+    def _find(self, term):
+        i = bisect.bisect_left(self._terms, term)
+        if i < len(self._terms) and self._terms[i] == term:
+            return i
+        return None
+
+    def has_term(self, term):
+        return self._find(term) is not None
+
+    def get(self, term, semtypes_mask=None):
+        i = self._find(term)
+        if i is None:
+            return
+
+        postings = self._postings[
+            self._posting_offsets[i]:self._posting_offsets[i + 1]
+        ]
+        for posting in postings:
+            position = posting & ~PREFERRED_BIT
+            mask_start = position * SEMTYPE_MASK_BYTES
+            mask = self._masks[mask_start:mask_start + SEMTYPE_MASK_BYTES]
+
+            if (
+                semtypes_mask is not None and
+                not int.from_bytes(mask, 'little') & semtypes_mask
+            ):
+                self.semtypes_rejected += 1
+                continue
+
+            yield (
+                int_to_cui(self._cui_ids[position]),
+                decode_semtypes(mask),
+                1 if posting & PREFERRED_BIT else 0
+            )
+
+    def _check_writable(self):
+        if self._mmap is not None:
+            raise IOError(
+                '"{}" is read-only; indexes can only be written when '
+                'they are first created'.format(self.path)
+            )
+
+    def put_term(self, term, cuis):
+        self._check_writable()
+        self._new_terms[term] = {
+            (cui_to_int(cui), 1 if is_preferred else 0)
+            for cui, is_preferred in cuis
+        }
+
+    def put_semtypes(self, cui, semtypes):
+        self._check_writable()
+        mask = encode_semtypes(semtypes)
+        if len(mask) > SEMTYPE_MASK_BYTES:
+            raise ValueError(
+                'Semantic types {} can\'t be stored in the index'
+                ''.format(', '.join(sorted(semtypes)))
+            )
+        self._new_semtypes[cui_to_int(cui)] = mask
+
+    def insert(self, term, cui, semtypes, is_preferred):
+        self._check_writable()
+
+        cui_id = cui_to_int(cui)
+        self._new_terms.setdefault(term, set()).add(
+            (cui_id, 1 if is_preferred else 0)
+        )
+
+        if cui_id not in self._new_semtypes:
+            self.put_semtypes(cui, semtypes)
+
+    def _write(self):
+        cui_ids = array('I', sorted(self._new_semtypes))
+        cui_positions = {cui_id: i for i, cui_id in enumerate(cui_ids)}
+        masks = b''.join(
+            self._new_semtypes[cui_id].ljust(SEMTYPE_MASK_BYTES, b'\0')
+            for cui_id in cui_ids
+        )
+
+        terms = sorted(self._new_terms)
+        term_offsets = array('Q', [0])
+        posting_offsets = array('Q', [0])
+        postings = array('I')
+        for term in terms:
+            term_offsets.append(term_offsets[-1] + len(term))
+            postings.extend(
+                cui_positions[cui_id] | (PREFERRED_BIT if is_preferred else 0)
+                for cui_id, is_preferred in sorted(self._new_terms[term])
+            )
+            posting_offsets.append(len(postings))
+
+        sections = [
+            term_offsets.tobytes(), b''.join(terms),
+            posting_offsets.tobytes(), postings.tobytes(),
+            cui_ids.tobytes(), masks
+        ]
+
+        offsets = []
+        position = self.HEADER.size
+        for section in sections:
+            position += -position % 8
+            offsets.append(position)
+            position += len(section)
+
+        with open(self.path, 'wb') as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, self.VERSION, len(terms), len(cui_ids), *offsets
+            ))
+            for offset, section in zip(offsets, sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(section)
+
+    def close(self):
+        if self._mmap is None:
+            self._write()
+            self._new_terms = self._new_semtypes = None
+        else:
+            self._terms = self._posting_offsets = self._postings = None
+            self._cui_ids = self._masks = None
+            self._mmap.close()
 
 
 class CuiSemTypesDB(object):
-    def __init__(self, path, database_backend='leveldb'):
+    def __init__(self, path, database_backend='leveldb',
+                 database_format='pickle'):
         if not (os.path.exists(path) or os.path.isdir(path)):
             err_msg = (
                 '"{}" is not a valid directory').format(path)
             raise IOError(err_msg)
 
+        if database_format not in {'pickle', 'compact'}:
+            raise ValueError(
+                f'database_format {database_format} not recognized'
+            )
+        self.database_format = database_format
+
         if database_backend == 'unqlite':
             assert UNQLITE_AVAILABLE, (
                 'You selected unqlite as database backend, but it is not '
@@ -246,40 +1003,255 @@ class CuiSemTypesDB(object):
             self.semtypes_db = leveldb.LevelDB(os.path.join(path, 'semtypes.leveldb'))
             self.semtypes_db_put = self.semtypes_db.Put
             self.semtypes_db_get = self.semtypes_db.Get
+        elif database_backend == 'mmap':
+            # the index always uses the compact encoding
+            self.index = CuiSemTypesIndex(
+                os.path.join(path, 'cui-semtypes.index')
+            )
         else:
             raise ValueError(f'database_backend {database_backend} not recognized')
+        self.database_backend = database_backend
+
+        # whether `get` can filter CUIs by semantic types bitmask
+        self.supports_semtypes_mask = (
+            database_backend == 'mmap' or database_format == 'compact'
+        )
+        self._semtypes_rejected = 0
+
+        # writes buffered in bulk mode (see `bulk`), as (replace, value)
+        # pairs keyed by database key
+        self._max_pending = None
+        self._pending_cuis = {}
+        self._pending_semtypes = {}
 
     def has_term(self, term):
         term = prepare_string_for_db_input(safe_unicode(term))
+        if self.database_backend == 'mmap':
+            return self.index.has_term(db_key_encode(term))
         try:
             self.cui_db_get(db_key_encode(term))
             return True
         except KeyError:
             return
 
+    def _encode_cuis_value(self, cuis):
+        if self.database_format == 'compact':
+            return encode_cuis(sorted(
+                (cui_to_int(cui), is_preferred) for cui, is_preferred in cuis
+            ))
+        return pickle.dumps(set(cuis))
+
+    def _decode_cuis_value(self, value):
+        if self.database_format == 'compact':
+            return {
+                (int_to_cui(cui_id), is_preferred)
+                for cui_id, is_preferred in decode_cuis(value)
+            }
+        return pickle.loads(value)
+
+    def _semtypes_key(self, cui):
+        if self.database_format == 'compact':
+            return encode_cui_key(cui_to_int(cui))
+        return db_key_encode(cui)
+
+    def _encode_semtypes_value(self, semtypes):
+        if self.database_format == 'compact':
+            return encode_semtypes(semtypes)
+        return pickle.dumps(set(semtypes))
+
+    @contextlib.contextmanager
+    def bulk(self, max_pending=100000):
+        """Context manager that buffers all writes in memory, and writes
+        them in batches (a leveldb WriteBatch or an unqlite transaction)
+        once more than max_pending terms and CUIs are pending, or when the
+        context is exited. Call flush to write pending entries earlier.
+        The mmap backend is always written in bulk, so this has no
+        effect on it."""
+        if self.database_backend == 'mmap' or self._max_pending is not None:
+            yield self
+            return
+
+        self._max_pending = max_pending
+        try:
+            yield self
+            self.flush()
+        finally:
+            self._max_pending = None
+            self._pending_cuis.clear()
+            self._pending_semtypes.clear()
+
+    def insert_many(self, entries, max_pending=100000):
+        """Insert (term, cui, semtypes, is_preferred) entries in bulk."""
+        with self.bulk(max_pending=max_pending):
+            for term, cui, semtypes, is_preferred in entries:
+                self.insert(term, cui, semtypes, is_preferred)
+
+    def _write_batch(self, db, items):
+        if self.database_backend == 'leveldb':
+            batch = leveldb.WriteBatch()
+            for key, value in items:
+                batch.Put(key, value)
+            db.Write(batch)
+        else:
+            with db.transaction():
+                for key, value in items:
+                    db.store(key, value)
+
+    def flush(self):
+        """Write all entries buffered in bulk mode"""
+        if self._max_pending is None:
+            return
+
+        cuis_items = []
+        for key, (replace, cuis) in self._pending_cuis.items():
+            # entries added through insert are merged with the stored ones
+            if not replace:
+                try:
+                    cuis = cuis | self._decode_cuis_value(self.cui_db_get(key))
+                except KeyError:
+                    pass
+            cuis_items.append((key, self._encode_cuis_value(cuis)))
+
+        semtypes_items = []
+        for key, (replace, value) in self._pending_semtypes.items():
+            # semantic types added through insert are only written once
+            if not replace:
+                try:
+                    self.semtypes_db_get(key)
+                    continue
+                except KeyError:
+                    pass
+            semtypes_items.append((key, value))
+
+        self._write_batch(self.cui_db, cuis_items)
+        self._write_batch(self.semtypes_db, semtypes_items)
+
+        self._pending_cuis.clear()
+        self._pending_semtypes.clear()
+
+    def _flush_if_full(self):
+        pending = len(self._pending_cuis) + len(self._pending_semtypes)
+        if pending >= self._max_pending:
+            self.flush()
+
     def insert(self, term, cui, semtypes, is_preferred):
         term = prepare_string_for_db_input(safe_unicode(term))
         cui = prepare_string_for_db_input(safe_unicode(cui))
 
+        if self.database_backend == 'mmap':
+            return self.index.insert(
+                db_key_encode(term), cui, semtypes, is_preferred
+            )
+
+        term_key = db_key_encode(term)
+        semtypes_key = self._semtypes_key(cui)
+
+        if self._max_pending is not None:
+            pending = self._pending_cuis.setdefault(term_key, (False, set()))
+            pending[1].add((cui, is_preferred))
+            if semtypes_key not in self._pending_semtypes:
+                self._pending_semtypes[semtypes_key] = (
+                    False, self._encode_semtypes_value(semtypes)
+                )
+            return self._flush_if_full()
+
         # some terms have multiple cuis associated with them,
         # so we store them all
         try:
-            cuis = pickle.loads(self.cui_db_get(db_key_encode(term)))
+            cuis = self._decode_cuis_value(self.cui_db_get(term_key))
         except KeyError:
             cuis = set()
 
         cuis.add((cui, is_preferred))
-        self.cui_db_put(db_key_encode(term), pickle.dumps(cuis))
+        self.cui_db_put(term_key, self._encode_cuis_value(cuis))
 
         try:
-            self.semtypes_db_get(db_key_encode(cui))
+            self.semtypes_db_get(semtypes_key)
         except KeyError:
             self.semtypes_db_put(
-                db_key_encode(cui), pickle.dumps(set(semtypes))
+                semtypes_key, self._encode_semtypes_value(semtypes)
             )
 
-    def get(self, term):
+    def put_term(self, term, cuis):
+        """Store all (cui, is_preferred) pairs term belongs to, replacing
+        any value previously stored for term. Unlike insert, this doesn't
+        need to read the database."""
         term = prepare_string_for_db_input(safe_unicode(term))
+        cuis = {
+            (prepare_string_for_db_input(safe_unicode(cui)), is_preferred)
+            for cui, is_preferred in cuis
+        }
+
+        if self.database_backend == 'mmap':
+            return self.index.put_term(db_key_encode(term), cuis)
+
+        if self._max_pending is not None:
+            self._pending_cuis[db_key_encode(term)] = (True, cuis)
+            return self._flush_if_full()
+
+        self.cui_db_put(db_key_encode(term), self._encode_cuis_value(cuis))
+
+    def put_semtypes(self, cui, semtypes):
+        """Store the semantic types of cui, replacing any value
+        previously stored for it."""
+        cui = prepare_string_for_db_input(safe_unicode(cui))
+
+        if self.database_backend == 'mmap':
+            return self.index.put_semtypes(cui, semtypes)
+
+        key = self._semtypes_key(cui)
+        value = self._encode_semtypes_value(semtypes)
+
+        if self._max_pending is not None:
+            self._pending_semtypes[key] = (True, value)
+            return self._flush_if_full()
+
+        self.semtypes_db_put(key, value)
+
+    def _get_compact(self, term, semtypes_mask):
+        try:
+            cuis = decode_cuis(self.cui_db_get(db_key_encode(term)))
+        except KeyError:
+            return
+
+        for cui_id, is_preferred in cuis:
+            semtypes = self.semtypes_db_get(encode_cui_key(cui_id))
+
+            if (
+                semtypes_mask is not None and
+                not int.from_bytes(semtypes, 'little') & semtypes_mask
+            ):
+                self._semtypes_rejected += 1
+                continue
+
+            yield int_to_cui(cui_id), decode_semtypes(semtypes), is_preferred
+
+    @property
+    def semtypes_rejected(self):
+        """Number of concepts skipped by `get` so far because none of their
+        semantic types was in semtypes_mask."""
+        if self.database_backend == 'mmap':
+            return self.index.semtypes_rejected
+        return self._semtypes_rejected
+
+    def get(self, term, semtypes_mask=None, normalized=False):
+        """Returns (cui, semtypes, is_preferred) for each concept term
+        belongs to. If semtypes_mask (see semtypes_to_mask) is given and
+        supports_semtypes_mask is True, concepts with none of the semantic
+        types in the mask are skipped before being decoded; otherwise,
+        semtypes_mask is ignored. If normalized is True, term is assumed
+        to have already gone through safe_unicode (e.g., because it was
+        returned by SimstringDBReader)."""
+        if not normalized:
+            term = safe_unicode(term)
+        term = prepare_string_for_db_input(term)
+
+        if self.database_backend == 'mmap':
+            return self.index.get(db_key_encode(term), semtypes_mask)
+
+        if self.database_format == 'compact':
+            return self._get_compact(term, semtypes_mask)
+
         try:
             cuis = pickle.loads(self.cui_db_get(db_key_encode(term)))
         except KeyError:
@@ -294,3 +1266,18 @@ class CuiSemTypesDB(object):
             for cui, is_preferred in cuis
         )
         return matches
+
+    def close(self):
+        """Close the databases; for the mmap backend, this is when a
+        new index is written to disk."""
+        if self.database_backend == 'mmap':
+            self.index.close()
+        elif self.database_backend == 'unqlite':
+            self.cui_db.close()
+            self.semtypes_db.close()
+        else:
+            # leveldb databases are closed when garbage collected, so
+            # all references to them (including bound methods) are dropped
+            self.cui_db = self.cui_db_get = self.cui_db_put = None
+            self.semtypes_db = self.semtypes_db_get = None
+            self.semtypes_db_put = None
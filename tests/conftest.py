@@ -0,0 +1,9 @@
+from __future__ import unicode_literals, division, print_function
+
+import os
+import sys
+
+# the synthetic UMLS used by the tests is shared with the benchmarks
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'
+))
@@ -0,0 +1,183 @@
+'''The compact database format (see toolbox.encode_cuis and
+toolbox.encode_semtypes) must store the same concepts as the pickle
+format.'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import spacy
+
+from quickumls import QuickUMLS, toolbox
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+# (term, cui, semtypes, is_preferred); semantic types include the lowest
+# and the highest ones the mmap index can store
+ENTRIES = [
+    ('chest pain', 'C0008031', {'T184'}, 1),
+    ('chest pain', 'C2926613', {'T033', 'T184'}, 0),
+    ('pain', 'C0030193', {'T184'}, 1),
+    ('first', 'C0000001', {'T000'}, 1),
+    ('last', 'C9999999', {'T255'}, 0),
+    ('all', 'C1234567', {'T000', 'T047', 'T128', 'T255'}, 1),
+]
+
+
+def concepts(matches):
+    return sorted(
+        (cui, sorted(semtypes), is_preferred)
+        for cui, semtypes, is_preferred in matches
+    )
+
+
+class TestCompactEncoding(unittest.TestCase):
+
+    def test_cuis(self):
+        for cui in ('C0000001', 'C0008031', 'C9999999'):
+            self.assertEqual(toolbox.int_to_cui(toolbox.cui_to_int(cui)), cui)
+
+        for cui in ('C000001', 'C00000001', 'D0000001', 'CUI1'):
+            with self.assertRaises(ValueError):
+                toolbox.cui_to_int(cui)
+
+    def test_cui_records(self):
+        cuis = [(1, 1), (8031, 0), (9999999, 1), (9999999, 0)]
+        data = toolbox.encode_cuis(cuis)
+        self.assertEqual(len(data), 4 * len(cuis))
+        self.assertEqual(toolbox.decode_cuis(data), cuis)
+        self.assertEqual(toolbox.decode_cuis(toolbox.encode_cuis([])), [])
+
+    def test_semtypes(self):
+        for semtypes in (
+                set(), {'T000'}, {'T047'}, {'T255'}, {'T999'},
+                {'T000', 'T047', 'T184', 'T255'}):
+            self.assertEqual(
+                toolbox.decode_semtypes(toolbox.encode_semtypes(semtypes)),
+                semtypes
+            )
+
+        # the highest semantic type the mmap index can store
+        self.assertEqual(
+            len(toolbox.encode_semtypes({'T255'})),
+            toolbox.SEMTYPE_MASK_BYTES
+        )
+
+    def test_semtypes_mask(self):
+        mask = toolbox.semtypes_to_mask({'T000', 'T047', 'T255'})
+        self.assertEqual(mask, 1 | 1 << 47 | 1 << 255)
+
+        with self.assertRaises(ValueError):
+            toolbox.semtypes_to_mask({'T047', 'Disease'})
+        self.assertEqual(
+            toolbox.semtypes_to_mask({'T047', 'Disease'}, ignore_invalid=True),
+            1 << 47
+        )
+
+
+class TestCompactDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def make_db(self, database_format):
+        path = os.path.join(self.workdir, database_format)
+        os.makedirs(path)
+        db = toolbox.CuiSemTypesDB(
+            path, database_backend='unqlite', database_format=database_format
+        )
+        for term, cui, semtypes, is_preferred in ENTRIES:
+            db.insert(term, cui, semtypes, is_preferred)
+        db.close()
+        return toolbox.CuiSemTypesDB(
+            path, database_backend='unqlite', database_format=database_format
+        )
+
+    def test_same_concepts_as_pickle(self):
+        pickle_db = self.make_db('pickle')
+        compact_db = self.make_db('compact')
+
+        for term in {term for term, _, _, _ in ENTRIES} | {'missing'}:
+            self.assertEqual(
+                concepts(compact_db.get(term)), concepts(pickle_db.get(term)),
+                term
+            )
+
+    def test_semtypes_mask(self):
+        compact_db = self.make_db('compact')
+        mask = toolbox.semtypes_to_mask({'T033', 'T255'})
+
+        self.assertEqual(
+            concepts(compact_db.get('chest pain', semtypes_mask=mask)),
+            [('C2926613', ['T033', 'T184'], 0)]
+        )
+        self.assertEqual(
+            concepts(compact_db.get('last', semtypes_mask=mask)),
+            [('C9999999', ['T255'], 0)]
+        )
+        self.assertEqual(concepts(compact_db.get('pain', semtypes_mask=mask)), [])
+        self.assertEqual(compact_db.semtypes_rejected, 2)
+
+
+class TestCompactInstallation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        vocab, cls.terms = make_umls(cls.workdir, 300, seed=0)
+        cls.documents = make_documents(
+            vocab, cls.terms, n_docs=20, doc_length=30, seed=0
+        )
+        for database_format in ('compact', 'pickle'):
+            install(
+                cls.workdir, os.path.join(cls.workdir, database_format),
+                'unqlite', '--database-format', database_format
+            )
+        cls.nlp = spacy.blank('en')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def make_matcher(self, database_format, **kwargs):
+        return QuickUMLS(
+            os.path.join(self.workdir, database_format),
+            spacy_component=True, **kwargs
+        )
+
+    def test_same_concepts_as_pickle(self):
+        compact_db = self.make_matcher('compact').cuisem_db
+        pickle_db = self.make_matcher('pickle').cuisem_db
+
+        self.assertEqual(compact_db.database_format, 'compact')
+        self.assertEqual(pickle_db.database_format, 'pickle')
+        for term in self.terms:
+            self.assertEqual(
+                concepts(compact_db.get(term)), concepts(pickle_db.get(term)),
+                term
+            )
+
+    def test_same_matches_as_pickle(self):
+        for accepted_semtypes in (None, ['T047', 'T184']):
+            compact = self.make_matcher(
+                'compact', accepted_semtypes=accepted_semtypes
+            )
+            pickle = self.make_matcher(
+                'pickle', accepted_semtypes=accepted_semtypes
+            )
+            for text in self.documents:
+                self.assertEqual(
+                    compact._match(self.nlp(text), best_match=False),
+                    pickle._match(self.nlp(text), best_match=False),
+                    text
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+'''Matches cached by QuickUMLS.match (see toolbox.DocumentCache) must be
+the same as those computed from scratch.'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+
+import spacy
+
+from quickumls import QuickUMLS
+from quickumls.network import MinimalServer, MinimalServerHandler, MinimalClient
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+class TestDocumentCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        vocab, terms = make_umls(cls.workdir, 300, seed=0)
+        cls.documents = make_documents(
+            vocab, terms, n_docs=20, doc_length=30, seed=0
+        )
+        cls.quickumls_fp = os.path.join(cls.workdir, 'quickumls')
+        install(cls.workdir, cls.quickumls_fp, 'unqlite')
+        cls.nlp = spacy.blank('en')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def make_matcher(self, **kwargs):
+        # the blank pipeline is used, so that no spaCy model is needed
+        matcher = QuickUMLS(self.quickumls_fp, spacy_component=True, **kwargs)
+        matcher.nlp = self.nlp
+        return matcher
+
+    def test_cached_matches_are_the_same(self):
+        for accepted_semtypes in (None, ['T047', 'T184']):
+            expected = [
+                self.make_matcher(
+                    accepted_semtypes=accepted_semtypes
+                ).match(text)
+                for text in self.documents
+            ]
+
+            matcher = self.make_matcher(
+                accepted_semtypes=accepted_semtypes, document_cache_size=100,
+                document_cache_fp=os.path.join(self.workdir, 'cache.db')
+            )
+            for _ in range(2):
+                self.assertEqual(
+                    [matcher.match(text) for text in self.documents],
+                    expected, 'accepted_semtypes={}'.format(accepted_semtypes)
+                )
+            matcher._document_cache.close()
+
+    def test_threaded_server(self):
+        # the in-memory cache is kept small, so that most documents are
+        # read from the SQLite database by the threads of the server
+        matcher = self.make_matcher(
+            document_cache_size=2,
+            document_cache_fp=os.path.join(self.workdir, 'server-cache.db')
+        )
+        expected = [matcher.match(text) for text in self.documents]
+
+        server = MinimalServer(('localhost', 0), MinimalServerHandler)
+        server.served_object = matcher
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        responses = {}
+
+        def send_requests(protocol):
+            client = MinimalClient(
+                QuickUMLS, port=server.server_address[1], protocol=protocol
+            )
+            try:
+                responses[protocol] = [
+                    client.match(text) for text in self.documents
+                ]
+            except Exception as ex:
+                responses[protocol] = ex
+            finally:
+                client.close()
+
+        try:
+            threads = [
+                threading.Thread(target=send_requests, args=(protocol, ))
+                for protocol in ('chunked', 'framed')
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        for protocol in ('chunked', 'framed'):
+            self.assertEqual(responses[protocol], expected, protocol)
+
+
+if __name__ == '__main__':
+    unittest.main()
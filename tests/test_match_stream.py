@@ -0,0 +1,88 @@
+'''QuickUMLS.match_stream must find the same matches however the text is
+split in chunks.'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import spacy
+
+from quickumls import QuickUMLS
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+class TestMatchStream(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        vocab, terms = make_umls(cls.workdir, 300, seed=0)
+        cls.text = ' '.join(make_documents(
+            vocab, terms, n_docs=20, doc_length=50, seed=0
+        ))
+        cls.quickumls_fp = os.path.join(cls.workdir, 'quickumls')
+        install(cls.workdir, cls.quickumls_fp, 'unqlite')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def setUp(self):
+        # the blank pipeline is used, so that no spaCy model is needed
+        self.matcher = QuickUMLS(
+            self.quickumls_fp, accepted_semtypes=None, spacy_component=True
+        )
+        self.matcher.nlp = spacy.blank('en')
+
+    def split(self, text, n_chunks, seed=0):
+        rnd = random.Random(seed)
+        cuts = sorted(rnd.sample(range(1, len(text)), n_chunks - 1))
+        return [
+            text[start:end]
+            for start, end in zip([0] + cuts, cuts + [len(text)])
+        ]
+
+    def test_same_matches_as_sentences(self):
+        for best_match in (True, False):
+            expected = []
+            for sent in self.matcher._get_sentences(
+                    self.matcher.nlp(self.text)):
+                matches = self.matcher._match(sent, best_match=best_match)
+                expected.extend(
+                    sorted(matches, key=lambda match: match[0]['start'])
+                )
+
+            for n_chunks in (1, 10, 500):
+                self.assertEqual(
+                    list(self.matcher.match_stream(
+                        self.split(self.text, n_chunks), best_match=best_match
+                    )),
+                    expected,
+                    'best_match={}, {} chunks'.format(best_match, n_chunks)
+                )
+
+    def test_long_sentences(self):
+        # without punctuation, the text is a single sentence, which is
+        # matched in pieces of max_buffer_tokens tokens
+        text = ''.join(
+            char for char in self.text if char not in {'.', ';'}
+        )
+        expected = self.matcher.match(text, best_match=False)
+        expected.sort(key=lambda match: match[0]['start'])
+
+        for n_chunks in (1, 10, 500):
+            self.assertEqual(
+                list(self.matcher.match_stream(
+                    self.split(text, n_chunks), best_match=False,
+                    max_buffer_tokens=50
+                )),
+                expected, '{} chunks'.format(n_chunks)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+'''The mmap database backend (see toolbox.CuiSemTypesIndex) must store the
+same concepts as the key-value backends.'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import spacy
+
+from quickumls import QuickUMLS, toolbox
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+# (term, cui, semtypes, is_preferred); semantic types include the lowest
+# and the highest ones the index can store
+ENTRIES = [
+    ('chest pain', 'C0008031', {'T184'}, 1),
+    ('chest pain', 'C2926613', {'T033', 'T184'}, 0),
+    ('pain', 'C0030193', {'T184'}, 1),
+    ('first', 'C0000001', {'T000'}, 1),
+    ('last', 'C9999999', {'T255'}, 0),
+    ('all', 'C1234567', {'T000', 'T047', 'T128', 'T255'}, 1),
+    ('douleur thoracique', 'C0008031', {'T184'}, 0),
+]
+
+
+def concepts(matches):
+    return sorted(
+        (cui, sorted(semtypes), is_preferred)
+        for cui, semtypes, is_preferred in matches
+    )
+
+
+class TestCuiSemTypesIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def make_db(self, database_backend, database_format='compact'):
+        path = os.path.join(self.workdir, database_backend + database_format)
+        os.makedirs(path)
+        db = toolbox.CuiSemTypesDB(
+            path, database_backend=database_backend,
+            database_format=database_format
+        )
+        for term, cui, semtypes, is_preferred in ENTRIES:
+            db.insert(term, cui, semtypes, is_preferred)
+        db.close()
+        return toolbox.CuiSemTypesDB(
+            path, database_backend=database_backend,
+            database_format=database_format
+        )
+
+    def test_same_concepts_as_unqlite(self):
+        mmap_db = self.make_db('mmap')
+        terms = {term for term, _, _, _ in ENTRIES} | {'missing', 'a', 'zzz'}
+
+        for database_format in ('compact', 'pickle'):
+            unqlite_db = self.make_db('unqlite', database_format)
+            for term in terms:
+                self.assertEqual(
+                    concepts(mmap_db.get(term)), concepts(unqlite_db.get(term)),
+                    '{} ({})'.format(term, database_format)
+                )
+                self.assertEqual(
+                    bool(mmap_db.has_term(term)),
+                    bool(unqlite_db.has_term(term)),
+                    '{} ({})'.format(term, database_format)
+                )
+
+    def test_semtypes_mask(self):
+        mmap_db = self.make_db('mmap')
+        unqlite_db = self.make_db('unqlite')
+
+        for semtypes in ({'T033', 'T255'}, {'T000'}, {'T184'}, {'T999'}):
+            mask = toolbox.semtypes_to_mask(semtypes)
+            for term, _, _, _ in ENTRIES:
+                self.assertEqual(
+                    concepts(mmap_db.get(term, semtypes_mask=mask)),
+                    concepts(unqlite_db.get(term, semtypes_mask=mask)),
+                    '{} {}'.format(term, sorted(semtypes))
+                )
+        self.assertEqual(
+            mmap_db.semtypes_rejected, unqlite_db.semtypes_rejected
+        )
+
+    def test_semtypes_out_of_range(self):
+        index = toolbox.CuiSemTypesIndex(
+            os.path.join(self.workdir, 'cui-semtypes.index')
+        )
+        with self.assertRaises(ValueError):
+            index.insert(b'pain', 'C0030193', {'T184', 'T256'}, 1)
+
+    def test_read_only(self):
+        mmap_db = self.make_db('mmap')
+        with self.assertRaises(IOError):
+            mmap_db.insert('pain', 'C0030193', {'T184'}, 1)
+
+
+class TestMmapInstallation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        vocab, cls.terms = make_umls(cls.workdir, 300, seed=0)
+        cls.documents = make_documents(
+            vocab, cls.terms, n_docs=20, doc_length=30, seed=0
+        )
+        install(cls.workdir, os.path.join(cls.workdir, 'mmap'), 'mmap')
+        install(
+            cls.workdir, os.path.join(cls.workdir, 'pickle'), 'unqlite',
+            '--database-format', 'pickle'
+        )
+        cls.nlp = spacy.blank('en')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def make_matcher(self, name, **kwargs):
+        return QuickUMLS(
+            os.path.join(self.workdir, name), spacy_component=True, **kwargs
+        )
+
+    def test_same_concepts_as_pickle(self):
+        mmap_db = self.make_matcher('mmap').cuisem_db
+        pickle_db = self.make_matcher('pickle').cuisem_db
+
+        self.assertEqual(mmap_db.database_backend, 'mmap')
+        for term in self.terms:
+            self.assertEqual(
+                concepts(mmap_db.get(term)), concepts(pickle_db.get(term)),
+                term
+            )
+
+    def test_same_matches_as_pickle(self):
+        for accepted_semtypes in (None, ['T047', 'T184']):
+            mmap = self.make_matcher('mmap', accepted_semtypes=accepted_semtypes)
+            pickle = self.make_matcher(
+                'pickle', accepted_semtypes=accepted_semtypes
+            )
+            for text in self.documents:
+                self.assertEqual(
+                    mmap._match(self.nlp(text), best_match=False),
+                    pickle._match(self.nlp(text), best_match=False),
+                    text
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
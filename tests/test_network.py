@@ -0,0 +1,261 @@
+'''Requests to MinimalServer and AsyncMinimalServer, with the chunked and
+the framed protocols.'''
+from __future__ import unicode_literals, division, print_function
+
+import socket
+import asyncio
+import unittest
+import threading
+
+from quickumls import network
+
+
+BUFFERSIZE = 256
+
+
+class Echo(object):
+    def echo(self, data, suffix=''):
+        return data + suffix
+
+    def words(self, text):
+        for word in text.split():
+            yield word
+
+    def fail(self, message):
+        raise KeyError(message)
+
+
+def send_raw(port, data):
+    """Send data on a new connection, and return everything the server
+    sends back before closing it."""
+    sock = socket.create_connection(('localhost', port))
+    try:
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+    finally:
+        sock.close()
+
+
+class TestFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_round_trip(self):
+        for data in (b'', b'x', b' padded ', bytes(range(256)) * 1000):
+            thread = threading.Thread(
+                target=network.send_frame, args=(data, self.sender)
+            )
+            thread.start()
+            self.assertEqual(network.receive_frame(self.receiver), data)
+            thread.join()
+
+    def test_closed_between_frames(self):
+        self.sender.close()
+        self.assertIsNone(network.receive_frame(self.receiver))
+
+    def test_truncated_header(self):
+        self.sender.sendall(network.FRAME_HEADER.pack(10)[:5])
+        self.sender.close()
+        with self.assertRaises(RuntimeError):
+            network.receive_frame(self.receiver)
+
+    def test_truncated_data(self):
+        self.sender.sendall(network.FRAME_HEADER.pack(10) + b'12345')
+        self.sender.close()
+        with self.assertRaises(RuntimeError):
+            network.receive_frame(self.receiver)
+
+    def test_size_limit(self):
+        self.sender.sendall(network.FRAME_HEADER.pack(11) + b'x' * 11)
+        with self.assertRaises(ValueError):
+            network.receive_frame(self.receiver, max_size=10)
+
+        # the header alone is enough to refuse a message
+        self.sender.sendall(network.FRAME_HEADER.pack(2 ** 64 - 1))
+        with self.assertRaises(ValueError):
+            network.receive_frame(self.receiver)
+
+
+class ServerTests(object):
+    """Tests shared by both servers; subclasses start a server on an
+    ephemeral port in setUp, and set self.port and self.max_frame_size."""
+
+    def make_client(self, protocol):
+        return network.MinimalClient(
+            Echo, port=self.port, buffersize=BUFFERSIZE, protocol=protocol
+        )
+
+    def test_requests(self):
+        for protocol in ('chunked', 'framed'):
+            client = self.make_client(protocol)
+            try:
+                self.assertEqual(client.echo('pain'), 'pain')
+                self.assertEqual(
+                    client.echo('chest', suffix=' pain  '), 'chest pain  '
+                )
+                self.assertEqual(
+                    client.words('acute renal failure'),
+                    ['acute', 'renal', 'failure']
+                )
+                with self.assertRaises(KeyError):
+                    client.fail('C0000001')
+            finally:
+                client.close()
+
+    def test_larger_than_buffer(self):
+        data = 'chest pain ' * (10 * BUFFERSIZE)
+        for protocol in ('chunked', 'framed'):
+            client = self.make_client(protocol)
+            try:
+                for _ in range(3):
+                    self.assertEqual(client.echo(data), data)
+            finally:
+                client.close()
+
+    def test_concurrent_requests(self):
+        client = self.make_client('framed')
+        responses = {}
+
+        def send_requests(i):
+            responses[i] = [
+                client.echo('{} {}'.format(i, j)) for j in range(20)
+            ]
+
+        threads = [
+            threading.Thread(target=send_requests, args=(i, ))
+            for i in range(4)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            client.close()
+
+        for i in range(4):
+            self.assertEqual(
+                responses[i], ['{} {}'.format(i, j) for j in range(20)]
+            )
+
+    def test_pipeline(self):
+        client = self.make_client('framed')
+        client.pipeline_depth = 4
+        try:
+            self.assertEqual(
+                client.pipeline(
+                    ('echo', (str(i), ), {'suffix': '!'}) for i in range(50)
+                ),
+                ['{}!'.format(i) for i in range(50)]
+            )
+            with self.assertRaises(KeyError):
+                client.pipeline([
+                    ('echo', ('pain', ), {}), ('fail', ('pain', ), {})
+                ])
+        finally:
+            client.close()
+
+        with self.assertRaises(ValueError):
+            self.make_client('chunked').pipeline([('echo', ('pain', ), {})])
+
+    def test_truncated_frame(self):
+        response = send_raw(
+            self.port,
+            network.FRAMED_PROTOCOL_MAGIC +
+            network.FRAME_HEADER.pack(100) + b'x' * 10
+        )
+        self.assertEqual(response, b'')
+
+        # the server keeps serving other clients
+        client = self.make_client('framed')
+        try:
+            self.assertEqual(client.echo('pain'), 'pain')
+        finally:
+            client.close()
+
+    def test_frame_too_large(self):
+        response = send_raw(
+            self.port,
+            network.FRAMED_PROTOCOL_MAGIC +
+            network.FRAME_HEADER.pack(self.max_frame_size + 1)
+        )
+        self.assertEqual(response, b'')
+
+        client = self.make_client('framed')
+        try:
+            with self.assertRaises(RuntimeError):
+                client.echo('x' * self.max_frame_size)
+            self.assertEqual(client.echo('pain'), 'pain')
+        finally:
+            client.close()
+
+
+class TestMinimalServer(ServerTests, unittest.TestCase):
+
+    def setUp(self):
+        self.max_frame_size = 64 * 1024
+        self.server = network.MinimalServer(
+            ('localhost', 0), network.MinimalServerHandler
+        )
+        self.server.served_object = Echo()
+        self.server.buffersize = BUFFERSIZE
+        self.server.max_frame_size = self.max_frame_size
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class TestAsyncMinimalServer(ServerTests, unittest.TestCase):
+
+    def setUp(self):
+        self.max_frame_size = 64 * 1024
+        server = network.AsyncMinimalServer(
+            Echo(), buffersize=BUFFERSIZE, n_threads=2,
+            max_frame_size=self.max_frame_size
+        )
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('localhost', 0))
+        sock.listen(128)
+        self.port = sock.getsockname()[1]
+
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(server.serve(sock=sock))
+
+        def run():
+            try:
+                self.loop.run_until_complete(self.task)
+            except asyncio.CancelledError:
+                pass
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
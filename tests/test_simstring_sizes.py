@@ -0,0 +1,105 @@
+'''Matching must not change when term sizes are used to skip simstring
+queries (see toolbox.SimstringDBReader.can_match).'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import spacy
+
+from quickumls import QuickUMLS, toolbox
+
+from synthetic_umls import make_umls, make_documents, install
+
+
+# terms whose trigrams are repeated by some of the documents below, and
+# retrieved by simstring outside of the theoretical dice size bounds
+TERMS = [
+    'pain', 'chest pain', 'acute renal failure', 'sugopi lipilu mipole rozose'
+]
+
+DOCUMENTS = [
+    'pain pain',
+    'sugopi sugopi lipilu mipole rozose',
+    'patient reports chest pain pain and acute renal renal failure',
+]
+
+SIMILARITIES = ['dice', 'jaccard', 'cosine', 'overlap']
+THRESHOLDS = [0.6, 0.7, 0.8, 0.9, 1.0]
+
+
+class TestSimstringSizes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        vocab, terms = make_umls(cls.workdir, 300, seed=0, extra_terms=TERMS)
+        cls.documents = DOCUMENTS + make_documents(
+            vocab, terms, n_docs=30, doc_length=20, seed=0
+        )
+        cls.quickumls_fp = os.path.join(cls.workdir, 'quickumls')
+        install(cls.workdir, cls.quickumls_fp, 'unqlite')
+        cls.sizes_fp = os.path.join(
+            cls.quickumls_fp, 'umls-simstring.db',
+            toolbox.SIMSTRING_SIZES_FILE
+        )
+        cls.nlp = spacy.blank('en')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def match_all(self, similarity_name, threshold):
+        matcher = QuickUMLS(
+            self.quickumls_fp, similarity_name=similarity_name,
+            threshold=threshold, accepted_semtypes=None,
+            spacy_component=True, ngram_cache_size=0
+        )
+        return [
+            [
+                matcher._match(self.nlp(text), best_match=best_match)
+                for text in self.documents
+            ]
+            for best_match in (True, False)
+        ]
+
+    def test_sizes_file_is_written(self):
+        self.assertTrue(os.path.exists(self.sizes_fp))
+
+    def test_matches_do_not_change(self):
+        for similarity_name in SIMILARITIES:
+            for threshold in THRESHOLDS:
+                with_sizes = self.match_all(similarity_name, threshold)
+
+                os.rename(self.sizes_fp, self.sizes_fp + '.bak')
+                try:
+                    without_sizes = self.match_all(similarity_name, threshold)
+                finally:
+                    os.rename(self.sizes_fp + '.bak', self.sizes_fp)
+
+                self.assertEqual(
+                    with_sizes, without_sizes,
+                    '{} at {}'.format(similarity_name, threshold)
+                )
+
+    def test_repeated_trigrams_are_retrieved(self):
+        for similarity_name in SIMILARITIES:
+            for threshold in THRESHOLDS:
+                reader = toolbox.SimstringDBReader(
+                    os.path.join(self.quickumls_fp, 'umls-simstring.db'),
+                    similarity_name, threshold
+                )
+                for query in ('pain pain', 'sugopi sugopi lipilu mipole rozose'):
+                    if reader.get(query):
+                        self.assertTrue(
+                            reader.can_match(toolbox.safe_unicode(query)),
+                            '{} at {}: {}'.format(
+                                similarity_name, threshold, query
+                            )
+                        )
+
+
+if __name__ == '__main__':
+    unittest.main()
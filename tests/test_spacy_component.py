@@ -0,0 +1,60 @@
+'''Span extensions registered by the spaCy component.'''
+from __future__ import unicode_literals, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import spacy
+from spacy.tokens import Span
+
+from quickumls.spacy_component import SpacyQuickUMLS, get_semtypes
+
+from synthetic_umls import make_umls, install
+
+
+class TestSpacyComponent(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        make_umls(cls.workdir, 100, seed=0)
+        cls.quickumls_fp = os.path.join(cls.workdir, 'quickumls')
+        install(cls.workdir, cls.quickumls_fp, 'unqlite')
+        cls.nlp = spacy.blank('en')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def tearDown(self):
+        # extensions are global; leave the ones of the component behind
+        if Span.has_extension('semtypes'):
+            Span.remove_extension('semtypes')
+        SpacyQuickUMLS(self.nlp, self.quickumls_fp)
+
+    def test_semtypes_are_a_set(self):
+        SpacyQuickUMLS(self.nlp, self.quickumls_fp)
+        span = self.nlp('chest pain')[0:2]
+        self.assertEqual(span._.semtypes, -1.0)
+
+        span._.semtypes = {'T184', 'T047'}
+        self.assertEqual(span._.semtypes, {'T047', 'T184'})
+        self.assertEqual(span._.quickumls_semtypes, ['T047', 'T184'])
+
+    def test_semtypes_registered_twice(self):
+        SpacyQuickUMLS(self.nlp, self.quickumls_fp)
+        SpacyQuickUMLS(self.nlp, self.quickumls_fp)
+        self.assertIs(Span.get_extension('semtypes')[2], get_semtypes)
+
+    def test_semtypes_registered_by_others(self):
+        if Span.has_extension('semtypes'):
+            Span.remove_extension('semtypes')
+        Span.set_extension('semtypes', default=None)
+        with self.assertRaises(ValueError):
+            SpacyQuickUMLS(self.nlp, self.quickumls_fp)
+
+
+if __name__ == '__main__':
+    unittest.main()